@@ -0,0 +1,40 @@
+"""
+ProjectError成员访问、成功响应生成以及抛出/捕获ProjectException的耗时
+运行: python -m benchmarks.bench_error
+"""
+import timeit
+
+from benchmarks import _setup  # noqa
+from djapi.error import ProjectError, ProjectException
+from djapi.req import json_response
+
+NUMBER = 100000
+
+
+def member_access():
+    return ProjectError.SUCCESS.code
+
+
+def non_member_access():
+    return ProjectError.__name__
+
+
+def success_response():
+    return json_response({'a': 1})
+
+
+def raise_and_catch():
+    try:
+        raise ProjectError.FIELD_MISSING("Field a is either missing or empty")
+    except ProjectException as e:
+        return e.code
+
+
+def main():
+    for func in (member_access, non_member_access, success_response, raise_and_catch):
+        seconds = min(timeit.repeat(func, number=NUMBER, repeat=5)) / NUMBER
+        print(f"{func.__name__:>18}: {seconds * 1e9:.0f} ns/op")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+"""
+get_json_field的解析开销基准，请求体只解析一次，耗时应与读取的字段数基本无关
+lazy=True时（需要安装pysimdjson）只转换读取到的字段
+运行: python -m benchmarks.bench_json_field
+"""
+import json
+import timeit
+
+from benchmarks import _setup  # noqa
+from django.test.client import RequestFactory
+from djapi.req import json_field_getter
+
+BODY_ITEMS = 5000
+REPEAT = 20
+
+
+def main():
+    factory = RequestFactory()
+    body = {f'f{i}': {'name': f'item {i}', 'values': list(range(10))} for i in range(BODY_ITEMS)}
+    payload = json.dumps(body)
+    print(f"body size: {len(payload) / 1024:.0f} KB")
+    for lazy in (False, True):
+        for field_count in (1, 10, 20, 40):
+            def run():
+                request = factory.post('', payload, content_type='application/json')
+                getter = json_field_getter(request, lazy=lazy)
+                for i in range(field_count):
+                    getter(f'f{i}', dict)
+
+            seconds = min(timeit.repeat(run, number=1, repeat=REPEAT))
+            print(f"lazy={lazy!s:<5} {field_count:>3} fields: {seconds * 1000:.2f} ms/request")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+ProjectExceptionMiddleware处理4xx错误的吞吐量，对比旧的日志方式（每次traceback.format_exc()）
+运行: python -m benchmarks.bench_middleware
+"""
+import logging
+import timeit
+import traceback
+
+from benchmarks import _setup  # noqa
+from django.test.client import RequestFactory
+from djapi.error import ProjectError, ProjectException, ErrorLogPolicy
+from djapi.error.middleware import ProjectExceptionMiddleware, logger
+
+NUMBER = 20000
+
+
+class LegacyLoggingMiddleware(ProjectExceptionMiddleware):
+    def process_exception(self, request, exception: Exception):
+        msg = traceback.format_exc()
+        if exception.secret_detail:
+            msg += f'\n{exception.secret_detail}'
+        logger.info(msg)
+        return super().process_exception(request, exception)
+
+
+def view(request):
+    raise ProjectError.FIELD_MISSING("Field a is either missing or empty")
+
+
+def run(middleware, request):
+    try:
+        view(request)
+    except ProjectException as e:
+        return middleware.process_exception(request, e)
+
+
+def main():
+    logger.handlers = [logging.NullHandler()]
+    logger.propagate = False
+    request = RequestFactory().post('/api/')
+    cases = (
+        ('legacy', LegacyLoggingMiddleware, None),
+        ('default', ProjectExceptionMiddleware, None),
+        ('sampled 1%', ProjectExceptionMiddleware, ErrorLogPolicy(sample_rates={2: 0.01})),
+    )
+    for level in (logging.INFO, logging.WARNING):
+        logger.setLevel(level)
+        for name, cls, policy in cases:
+            middleware = cls(lambda x: x)
+            if policy is not None:
+                middleware.log_policy = policy
+            # LegacyLoggingMiddleware先按旧方式记录日志，再关闭新日志，只计算旧方式的开销
+            if cls is LegacyLoggingMiddleware:
+                middleware.log_policy = ErrorLogPolicy(sample_rates={2: 0})
+            seconds = min(timeit.repeat(lambda: run(middleware, request), number=NUMBER, repeat=3))
+            print(f"logger {logging.getLevelName(level):>7}, {name:>10}: {NUMBER / seconds:,.0f} errors/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""
+逐字段getter与编译后的Schema校验整个请求体的耗时对比
+运行: python -m benchmarks.bench_schema
+"""
+import timeit
+
+from benchmarks import _setup  # noqa
+from django.test.client import RequestFactory
+from djapi.req import json_field_getter, Schema, Field
+
+FIELD_COUNT = 30
+NUMBER = 2000
+
+
+def main():
+    factory = RequestFactory()
+    body = {f'f{i}': i for i in range(FIELD_COUNT)}
+    schema = Schema({f'f{i}': Field(int, allowed_values=range(FIELD_COUNT)) for i in range(FIELD_COUNT)})
+    request = factory.post('', body, content_type='application/json')
+
+    def getters():
+        getter = json_field_getter(request)
+        return {f'f{i}': getter(f'f{i}', int, allow_empty=True, allowed_values=range(FIELD_COUNT))
+                for i in range(FIELD_COUNT)}
+
+    def compiled():
+        return schema.validate(request)
+
+    assert getters() == compiled()
+    for name, func in (('getters', getters), ('schema', compiled)):
+        seconds = min(timeit.repeat(func, number=NUMBER, repeat=5)) / NUMBER
+        print(f"{name:>8}: {seconds * 1e6:.1f} us/request ({FIELD_COUNT} fields)")
+
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,7 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.urls import path
+from djapi.req import batch_dispatcher
 import tests.views as views
 
 urlpatterns = [
@@ -22,5 +23,9 @@ urlpatterns = [
     path('functional_test_multipart', views.functional_test_multipart, name='multipart'),
     path('functional_test_other/', views.functional_test_other_view, name='other'),
     path('test_json_client/', views.test_json_client, name='json_client'),
-    path('test_json_requester/', views.test_json_requester, name='json_requester')
+    path('test_json_requester/', views.test_json_requester, name='json_requester'),
+    path('test_slow/', views.test_slow_view, name='slow'),
+    path('test_async/', views.test_async_view, name='async'),
+    path('test_cache_control/', views.test_cache_control_view, name='cache_control'),
+    path('test_batch/', batch_dispatcher(max_items=5), name='batch'),
 ]
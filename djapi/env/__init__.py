@@ -1,9 +1,26 @@
 import os
+import re
 import dotenv
 from ast import literal_eval
 from django.conf import settings
 
 __loaded = False
+# (变量名, 类型) -> 解析后的值，变量不存在时为_UNSET
+_cache = {}
+_UNSET = object()
+_declared = {}
+
+_TRUE_VALUES = frozenset(['1', 'true', 'yes', 'on'])
+_FALSE_VALUES = frozenset(['0', 'false', 'no', 'off'])
+_DURATION = re.compile(r'^\s*(\d+(?:\.\d*)?)\s*(ms|s|m|h|d)?\s*$')
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, None: 1}
+
+
+def _load_dotenv():
+    global __loaded
+    if not __loaded:
+        dotenv.load_dotenv(encoding='utf-8', dotenv_path=dotenv.find_dotenv(usecwd=settings.BASE_DIR))
+        __loaded = True
 
 
 def get_var(name, is_string: bool = True, default=None):
@@ -15,10 +32,7 @@ def get_var(name, is_string: bool = True, default=None):
     """
     if is_string and default is not None:
         assert isinstance(default, str), "default must be a string"
-    global __loaded
-    if not __loaded:
-        dotenv.load_dotenv(encoding='utf-8', dotenv_path=dotenv.find_dotenv(usecwd=settings.BASE_DIR))
-        __loaded = True
+    _load_dotenv()
     value = os.environ.get(name)
     if not value:
         if default is None:
@@ -30,3 +44,121 @@ def get_var(name, is_string: bool = True, default=None):
         return literal_eval(value)
     except (ValueError, SyntaxError):
         raise ValueError(f'Cannot evaluate "{name}" (value: {value})')
+
+
+def _get_cached(name, default, kind: str, parse):
+    """
+    读取并解析环境变量，解析结果缓存到reload()被调用为止
+    """
+    key = (name, kind)
+    value = _cache.get(key)
+    if value is None:
+        _load_dotenv()
+        raw = os.environ.get(name)
+        if not raw:
+            value = _UNSET
+        else:
+            try:
+                value = parse(raw)
+            except (ValueError, SyntaxError):
+                raise ValueError(f'Cannot parse "{name}" as {kind} (value: {raw})')
+        _cache[key] = value
+    if value is _UNSET:
+        if default is None:
+            raise ValueError(f'"{name}" is not set. Please check your .env file.')
+        return default
+    return value
+
+
+def _parse_bool(raw: str) -> bool:
+    value = raw.strip().lower()
+    if value in _TRUE_VALUES:
+        return True
+    if value in _FALSE_VALUES:
+        return False
+    # 兼容get_var(is_string=False)的写法，python字面量按真值判断，例如2、None
+    return bool(literal_eval(raw.strip()))
+
+
+def _parse_list(raw: str) -> list:
+    if raw.lstrip().startswith('['):
+        value = literal_eval(raw)
+        if not isinstance(value, list):
+            raise ValueError(raw)
+        return value
+    return [x.strip() for x in raw.split(',') if x.strip()]
+
+
+def _parse_duration(raw: str) -> float:
+    match = _DURATION.match(raw)
+    if not match:
+        raise ValueError(raw)
+    return float(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+def get_str(name, default: str = None) -> str:
+    return _get_cached(name, default, 'string', str)
+
+
+def get_int(name, default: int = None) -> int:
+    return _get_cached(name, default, 'integer', int)
+
+
+def get_float(name, default: float = None) -> float:
+    return _get_cached(name, default, 'float', float)
+
+
+def get_bool(name, default: bool = None) -> bool:
+    """
+    true/false、yes/no、on/off、1/0，不区分大小写，其它python字面量按真值判断
+    """
+    return _get_cached(name, default, 'boolean', _parse_bool)
+
+
+def get_list(name, default: list = None) -> list:
+    """
+    逗号分隔的字符串列表，或者python列表字面量，例如 a,b,c 或 [1, 2, 3]
+    """
+    return _get_cached(name, default, 'list', _parse_list)
+
+
+def get_duration(name, default: float = None) -> float:
+    """
+    时长，返回秒数，单位可以是ms、s、m、h、d，没有单位时为秒，例如 500ms、30s、1.5h
+    """
+    return _get_cached(name, default, 'duration', _parse_duration)
+
+
+def declare(name, getter=get_str, default=None):
+    """
+    声明项目使用的配置项，由validate()在启动时统一检查
+    :param name: 变量名
+    :param getter: get_str、get_int、get_float、get_bool、get_list或get_duration
+    :param default: 默认值，不提供时变量必须存在
+    :return: 无参数的函数，返回配置项的值
+    """
+    _declared[name] = getter, default
+    return lambda: getter(name, default)
+
+
+def validate():
+    """
+    解析所有通过declare()声明的配置项，汇总所有错误后抛出ValueError，一般在AppConfig.ready()中调用
+    """
+    errors = []
+    for name, (getter, default) in _declared.items():
+        try:
+            getter(name, default)
+        except ValueError as e:
+            errors.append(str(e))
+    if errors:
+        raise ValueError('\n'.join(errors))
+
+
+def reload():
+    """
+    清空缓存，重新读取.env文件和环境变量，用于测试或者运行时修改了环境变量
+    """
+    global __loaded
+    __loaded = False
+    _cache.clear()
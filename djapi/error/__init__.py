@@ -1,3 +1,4 @@
 from djapi.error.error_code import ProjectError, ProjectException, e  # noqan
 from djapi.error.error_handler import ModelExceptionHandler  # noqar
-from djapi.error.middleware import ProjectExceptionMiddleware  # noqae
\ No newline at end of file
+from djapi.error.log_policy import ErrorLogPolicy  # noqa
+from djapi.error.middleware import ProjectExceptionMiddleware  # noqa
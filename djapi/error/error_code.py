@@ -4,9 +4,6 @@ class ProjectException(Exception):
     """
     _code_set = set()
 
-    def __new__(cls, *args, **kwargs):
-        return super().__new__(cls, *args, **kwargs)
-
     def __init__(self, msg: str, code: int, status_code: int = 422, data=None, error_detail=None, secret_detail=None):
         self.msg = msg
         self.code = code
@@ -46,33 +43,49 @@ class ProjectException(Exception):
         )
 
 
+_new_exception = Exception.__new__
+
+
+class _ErrorMember:
+    """
+    ProjectError成员的描述符，类属性查找由解释器完成，不再经过元类的__getattribute__
+    每次访问返回一个新的ProjectException，避免同时抛出的异常共享error_detail和traceback
+    """
+    __slots__ = ('msg', 'code', 'status_code')
+
+    def __init__(self, value: ProjectException):
+        self.msg = value.msg
+        self.code = value.code
+        self.status_code = value.status_code
+
+    def __get__(self, instance, owner) -> ProjectException:
+        # 跳过__init__，只设置必要的属性
+        exc = _new_exception(ProjectException, self.msg)
+        exc.__dict__.update(msg=self.msg, code=self.code, status_code=self.status_code,
+                            error_detail=None, secret_detail=None, data={})
+        return exc
+
+
 class ProjectErrorMetaClass(type):
     _error_code_dict = {}
-    _enum_members = set()
 
     def __new__(mcs, cls_name, bases, class_dict):
-        for member, value in class_dict.items():
+        for member, value in list(class_dict.items()):
             if isinstance(value, ProjectException):
                 if value.code in ProjectErrorMetaClass._error_code_dict:
                     prev_class, prev_member, _ = ProjectErrorMetaClass._error_code_dict[value.code]
                     raise ValueError(
                         f"Both {prev_class}.{prev_member} and {cls_name}.{member} have error code {value.code}")
-                ProjectErrorMetaClass._error_code_dict[value.code] = cls_name, member, value
-                ProjectErrorMetaClass._enum_members.add(member)
+                descriptor = _ErrorMember(value)
+                ProjectErrorMetaClass._error_code_dict[value.code] = cls_name, member, descriptor
+                class_dict[member] = descriptor
         return super().__new__(mcs, cls_name, bases, class_dict)
 
-    def __getattribute__(self, item):
-        super_item = super().__getattribute__(item)
-        if item in ProjectErrorMetaClass._enum_members:
-            return ProjectException(msg=super_item.msg, code=super_item.code, status_code=super_item.status_code)
-        return super_item
-
     def __setattr__(self, key, value):
         raise ValueError("Cannot set attributes to ProjectError")
 
     def __getitem__(self, item: int) -> ProjectException:
-        super_item = self._error_code_dict[item][2]
-        return ProjectException(msg=super_item.msg, code=super_item.code, status_code=super_item.status_code)
+        return ProjectErrorMetaClass._error_code_dict[item][2].__get__(None, self)
 
 
 e = ProjectException
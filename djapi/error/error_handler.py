@@ -26,3 +26,9 @@ class ModelExceptionHandler:
         elif issubclass(exc_type, MultipleObjectsReturned):
             raise ProjectError.MULTIPLE_RECORDS(f"多条记录满足{self._display_name}，请缩小查询范围")
         return False
+
+    async def __aenter__(self):
+        pass
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return self.__exit__(exc_type, exc_val, exc_tb)
@@ -0,0 +1,65 @@
+import logging
+import random
+import threading
+import time
+
+from djapi.env import get_bool, get_int, get_list
+
+__all__ = ['ErrorLogPolicy']
+
+
+class ErrorLogPolicy:
+    """
+    ProjectExceptionMiddleware记录ProjectException（预期内的错误，例如参数校验失败）日志的策略
+    未知异常总是以ERROR级别记录异常栈，不受此策略影响
+    """
+
+    def __init__(self, level=logging.INFO, capture_stack: bool = False, sample_rates: dict = None,
+                 rate_limit: int = 0):
+        """
+        :param level: 日志级别
+        :param capture_stack: 是否记录异常栈，默认只记录错误码、错误信息、请求路径和耗时
+        :param sample_rates: {错误码: 采样率}，采样率为0~1之间的小数，未指定的错误码全部记录
+        :param rate_limit: 每个错误码每秒最多记录的日志条数，0为不限制
+        """
+        self.level = level
+        self.capture_stack = capture_stack
+        self.sample_rates = sample_rates or {}
+        self.rate_limit = rate_limit
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'ErrorLogPolicy':
+        """
+        由环境变量生成策略:
+        DJAPI_ERROR_LOG_STACK: 是否记录异常栈，默认False
+        DJAPI_ERROR_LOG_SAMPLE_RATES: 错误码:采样率，逗号分隔，例如 403:0.1,3:0.01
+        DJAPI_ERROR_LOG_RATE_LIMIT: 每个错误码每秒最多记录的日志条数，默认0（不限制）
+        """
+        sample_rates = {}
+        for item in get_list('DJAPI_ERROR_LOG_SAMPLE_RATES', default=[]):
+            code, _, rate = str(item).partition(':')
+            try:
+                sample_rates[int(code)] = float(rate)
+            except ValueError:
+                raise ValueError(f'Invalid DJAPI_ERROR_LOG_SAMPLE_RATES item "{item}", expecting code:rate')
+        return cls(capture_stack=get_bool('DJAPI_ERROR_LOG_STACK', default=False), sample_rates=sample_rates,
+                   rate_limit=get_int('DJAPI_ERROR_LOG_RATE_LIMIT', default=0))
+
+    def should_log(self, code: int) -> bool:
+        rate = self.sample_rates.get(code)
+        if rate is not None and random.random() >= rate:
+            return False
+        if not self.rate_limit:
+            return True
+        now = int(time.monotonic())
+        with self._lock:
+            window = self._windows.get(code)
+            if window is None or window[0] != now:
+                self._windows[code] = [now, 1]
+                return True
+            if window[1] >= self.rate_limit:
+                return False
+            window[1] += 1
+            return True
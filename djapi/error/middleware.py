@@ -1,45 +1,164 @@
+import asyncio
 import logging
-import traceback
-import json
+import threading
+import time
+from collections import OrderedDict
 
 from django.http import HttpResponse
-from djapi.env import get_var
+from djapi import metrics, serializer
+from djapi.env import get_bool
 from djapi.error.error_code import ProjectError, ProjectException
+from djapi.error.log_policy import ErrorLogPolicy
+
+try:
+    from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+except ImportError:  # pragma: no cover asgiref<3.6
+    from asyncio import iscoroutinefunction
+
+    def markcoroutinefunction(func):
+        func._is_coroutine = asyncio.coroutines._is_coroutine
+        return func
 
 __all__ = ['ProjectError', 'ProjectException', 'ProjectExceptionMiddleware']
 
 logger = logging.getLogger('django')
 
+_START_ATTR = '_djapi_start'
+# 异步模式下middleware实例保存在request上，由异步视图的装饰器直接在事件循环中处理异常
+_MIDDLEWARE_ATTR = '_djapi_exception_middleware'
+
+
+def _view_name(request) -> str:
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else '<unresolved>'
+
+
+class _ErrorBodyCache:
+    """
+    错误响应体的序列化结果缓存，大部分4xx响应的响应体对于同一个错误码和错误信息是相同的
+    没有error_detail的错误按(JSON后端, 错误码, 错误信息)永久缓存，
+    error_detail为字符串的错误只保留最近使用的maxsize个，带data或者error_detail为其它类型的错误不缓存
+    （1、True和1.0作为键相等，但序列化结果不同）
+    """
+
+    def __init__(self, maxsize: int = 256, static_maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.static_maxsize = static_maxsize
+        self._static = {}
+        self._detail = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, exception: ProjectException) -> bytes:
+        if exception.data:
+            return serializer.dumps(exception.to_dict())
+        backend = serializer.get_backend()
+        detail = exception.error_detail
+        if not detail:
+            key = (backend, exception.code, exception.msg)
+            body = self._static.get(key)
+            if body is None:
+                body = backend.dumps(exception.to_dict())
+                if len(self._static) < self.static_maxsize:
+                    self._static[key] = body
+            return body
+        if type(detail) is not str:
+            return backend.dumps(exception.to_dict())
+        key = (backend, exception.code, exception.msg, detail)
+        with self._lock:
+            body = self._detail.get(key)
+            if body is not None:
+                self._detail.move_to_end(key)
+                return body
+        body = backend.dumps(exception.to_dict())
+        with self._lock:
+            self._detail[key] = body
+            if len(self._detail) > self.maxsize:
+                self._detail.popitem(last=False)
+        return body
+
+    def clear(self):
+        with self._lock:
+            self._static.clear()
+            self._detail.clear()
+
 
 class ProjectExceptionMiddleware:
+    """
+    将视图抛出的异常转为JSON响应，同时支持WSGI和ASGI
+    Django总是在线程池中调用process_exception，ASGI下由require_*_api装饰的异步视图会直接在事件循环中处理异常
+    """
+    sync_capable = True
+    async_capable = True
+    # 记录ProjectException日志的策略，为None时由环境变量生成，见ErrorLogPolicy.from_env
+    log_policy: ErrorLogPolicy = None
+
     def __init__(self, get_response):
         self.get_response = get_response
         # One-time configuration and initialization.
+        if self.log_policy is None:
+            self.log_policy = ErrorLogPolicy.from_env()
+        # 启动时检查配置，配置错误不会等到处理异常时才报错
+        get_bool("RE_RAISE_UNKNOWN_EXCEPTIONS", default=False)
+        self.error_bodies = _ErrorBodyCache()
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
         # Code to be executed for each request before
         # the view (and later middleware) are called.
+        request.__dict__[_START_ATTR] = start = time.perf_counter()
+        if metrics.sink is None:
+            return self.get_response(request)
 
-        response = self.get_response(request)
-
-        # Code to be executed for each request/response after
-        # the view is called.
+        token = metrics._begin()
+        try:
+            response = self.get_response(request)
+        finally:
+            # Code to be executed for each request/response after
+            # the view is called.
+            metrics._end(token, _view_name(request), time.perf_counter() - start)
 
         return response
 
+    async def __acall__(self, request):
+        request.__dict__[_START_ATTR] = start = time.perf_counter()
+        request.__dict__[_MIDDLEWARE_ATTR] = self
+        if metrics.sink is None:
+            return await self.get_response(request)
+        token = metrics._begin()
+        try:
+            return await self.get_response(request)
+        finally:
+            metrics._end(token, _view_name(request), time.perf_counter() - start)
+
+    def _log_extra(self, request, code):
+        start = getattr(request, _START_ATTR, None)
+        return {
+            'code': code,
+            'path': getattr(request, 'path', None),
+            'latency': None if start is None else time.perf_counter() - start,
+        }
+
     def process_exception(self, request, exception: Exception):
         if not isinstance(exception, ProjectException):
             # 未知异常，记录异常栈
-            logger.error(traceback.format_exc())
-            if get_var("RE_RAISE_UNKNOWN_EXCEPTIONS", is_string=False, default=False):
+            logger.error("Unhandled exception: %r", exception, exc_info=exception,
+                         extra=self._log_extra(request, ProjectError.UNKNOWN_ERROR.code))
+            if get_bool("RE_RAISE_UNKNOWN_EXCEPTIONS", default=False):
                 raise exception
             exception = ProjectError.UNKNOWN_ERROR
         else:
-            msg = traceback.format_exc()
-            if exception.secret_detail:
-                msg += f'\n{exception.secret_detail}'
-            logger.info(msg)
-        r = HttpResponse(json.dumps(exception.to_dict(), ensure_ascii=False),
-                         content_type='application/json; charset=utf-8')
+            # 预期内的错误，日志只在需要时生成，不记录异常栈
+            policy = self.log_policy
+            if logger.isEnabledFor(policy.level) and policy.should_log(exception.code):
+                extra = self._log_extra(request, exception.code)
+                logger.log(policy.level, "[%s] %s: %s", exception.code, extra['path'], exception,
+                           exc_info=exception if policy.capture_stack else None, extra=extra)
+        if metrics.sink is not None:
+            metrics.record_error(exception.code)
+        r = HttpResponse(self.error_bodies.get(exception), content_type='application/json; charset=utf-8')
         r.status_code = exception.status_code
         return r
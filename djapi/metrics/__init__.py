@@ -0,0 +1,219 @@
+import abc
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from django.http import HttpResponse
+
+__all__ = ['MetricsSink', 'InMemorySink', 'CallbackSink', 'enable', 'disable', 'get_sink', 'prometheus_view']
+
+# 当前启用的sink，为None时所有统计代码只做一次判断
+sink = None
+# 当前请求各阶段的耗时，由ProjectExceptionMiddleware在请求开始时创建，请求结束时提交给sink
+_timings = ContextVar('djapi_metrics_timings', default=None)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class MetricsSink(abc.ABC):
+    """
+    接收统计数据，stage为parse（解析请求体）、validation（字段校验）、serialization（序列化响应）
+    或total（整个请求），子类必须实现observe和count_error
+    """
+
+    @abc.abstractmethod
+    def observe(self, view: str, stage: str, seconds: float):
+        pass
+
+    @abc.abstractmethod
+    def count_error(self, view: str, code: int):
+        pass
+
+
+class CallbackSink(MetricsSink):
+    """
+    将统计数据交给回调函数，例如发送到statsd
+    """
+
+    def __init__(self, observe=None, count_error=None):
+        """
+        :param observe: observe(view, stage, seconds)
+        :param count_error: count_error(view, code)
+        """
+        self._observe = observe
+        self._count_error = count_error
+
+    def observe(self, view, stage, seconds):
+        if self._observe is not None:
+            self._observe(view, stage, seconds)
+
+    def count_error(self, view, code):
+        if self._count_error is not None:
+            self._count_error(view, code)
+
+
+class _Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class InMemorySink(MetricsSink):
+    """
+    在进程内保存每个视图各阶段耗时的直方图和错误码计数，可以通过prometheus_view导出
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._histograms = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def observe(self, view, stage, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get((view, stage))
+            if histogram is None:
+                histogram = self._histograms[(view, stage)] = _Histogram(len(self.buckets) + 1)
+            histogram.counts[index] += 1
+            histogram.sum += seconds
+            histogram.count += 1
+
+    def count_error(self, view, code):
+        with self._lock:
+            self._errors[(view, code)] = self._errors.get((view, code), 0) + 1
+
+    def snapshot(self) -> dict:
+        """
+        :return: {'histograms': {(view, stage): {'buckets': {上限: 累计次数}, 'sum': 总耗时, 'count': 次数}},
+                  'errors': {(view, code): 次数}}
+        """
+        with self._lock:
+            histograms = {}
+            for key, histogram in self._histograms.items():
+                cumulative, buckets = 0, {}
+                for bound, count in zip(self.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    buckets[bound] = cumulative
+                histograms[key] = {'buckets': buckets, 'sum': histogram.sum, 'count': histogram.count}
+            return {'histograms': histograms, 'errors': dict(self._errors)}
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._errors.clear()
+
+    def render_prometheus(self) -> str:
+        snapshot = self.snapshot()
+        lines = ['# HELP djapi_stage_seconds Time spent in each stage of djapi requests',
+                 '# TYPE djapi_stage_seconds histogram']
+        for (view, stage), histogram in sorted(snapshot['histograms'].items()):
+            labels = f'view="{_escape(view)}",stage="{stage}"'
+            for bound, count in histogram['buckets'].items():
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append(f'djapi_stage_seconds_bucket{{{labels},le="{le}"}} {count}')
+            lines.append(f'djapi_stage_seconds_sum{{{labels}}} {histogram["sum"]!r}')
+            lines.append(f'djapi_stage_seconds_count{{{labels}}} {histogram["count"]}')
+        lines += ['# HELP djapi_errors_total Number of error responses by error code',
+                  '# TYPE djapi_errors_total counter']
+        for (view, code), count in sorted(snapshot['errors'].items()):
+            lines.append(f'djapi_errors_total{{view="{_escape(view)}",code="{code}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def enable(metrics_sink: MetricsSink = None) -> MetricsSink:
+    """
+    开启统计，一般在AppConfig.ready()中调用
+    :param metrics_sink: 默认为InMemorySink
+    """
+    global sink
+    sink = metrics_sink or InMemorySink()
+    return sink
+
+
+def disable():
+    global sink
+    sink = None
+
+
+def get_sink() -> MetricsSink:
+    return sink
+
+
+def record(stage: str, seconds: float):
+    """
+    累加当前请求某个阶段的耗时
+    """
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def record_error(code: int):
+    """
+    记录当前请求返回的错误码
+    """
+    timings = _timings.get()
+    if timings is not None:
+        timings['error_code'] = code
+
+
+def timed(stage: str, before=None):
+    """
+    统计被装饰函数的耗时，未开启统计时只多一次判断
+    :param stage: 阶段名
+    :param before: 开始计时前调用的函数，参数与被装饰函数相同，例如先解析请求体，避免解析时间被计入校验时间
+    """
+    def decorator(func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            if sink is None:
+                return func(*args, **kwargs)
+            if before is not None:
+                before(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(stage, time.perf_counter() - start)
+
+        return inner
+
+    return decorator
+
+
+def _begin():
+    return _timings.set({})
+
+
+def _end(token, view: str, seconds: float):
+    timings = _timings.get()
+    _timings.reset(token)
+    current = sink
+    if current is None or timings is None:
+        return
+    error_code = timings.pop('error_code', None)
+    for stage, stage_seconds in timings.items():
+        current.observe(view, stage, stage_seconds)
+    current.observe(view, 'total', seconds)
+    if error_code is not None:
+        current.count_error(view, error_code)
+
+
+def prometheus_view(request):
+    """
+    以Prometheus文本格式导出InMemorySink中的数据
+    """
+    from djapi.error import ProjectError
+    if not isinstance(sink, InMemorySink):
+        raise ProjectError.NOT_FOUND("In-memory metrics are not enabled")
+    return HttpResponse(sink.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
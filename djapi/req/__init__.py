@@ -1,3 +1,14 @@
+from djapi.req.lazy_json import *  # noqa
 from djapi.req.request import *  # noqa
+from djapi.req.params import *  # noqa
 from djapi.req.response import *  # noqa
+from djapi.req.compression import *  # noqa
+from djapi.req.circuit import *  # noqa
 from djapi.req.remote import *  # noqa
+from djapi.req.schema import *  # noqa
+from djapi.req.async_remote import *  # noqa
+from djapi.req.json_stream import *  # noqa
+from djapi.req.upload import *  # noqa
+from djapi.req.pagination import *  # noqa
+from djapi.req.cache import *  # noqa
+from djapi.req.batch import *  # noqa
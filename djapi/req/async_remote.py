@@ -0,0 +1,115 @@
+import asyncio
+import time
+
+from djapi import serializer
+from djapi.error import ProjectError
+from djapi.req.remote import JSONResult, _invalid_json_error, _raise_for_code, _SUCCESS_CODE
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+__all__ = ['AsyncJSONRequester']
+
+
+class AsyncJSONRequester:
+    """
+    asyncio version of JSONRequester, backed by a connection-pooled httpx.AsyncClient.
+    Every call returns a JSONResult, so concurrent calls on one requester do not interfere::
+
+        async with AsyncJSONRequester() as requester:
+            user, orders = await requester.gather(
+                requester.get(user_url), requester.get(orders_url), limit=5, deadline=2)
+            print(user.data, orders.data)
+    """
+
+    def __init__(self, djapi=True, raise_on_error_code=True, client=None, max_connections=100,
+                 max_keepalive_connections=20, timeout=None):
+        """
+        :param djapi: whether remote server uses djapi
+        :param raise_on_error_code: if remote server uses djapi,
+                    raise ProjectError when 'code' in response is not 0 (Success).
+                    if code is not defined in ProjectError, ProjectError.REMOTE_SERVER_ERROR will be raised
+        :param client: use this httpx.AsyncClient instead of creating one, pool and timeout options are ignored
+        :param max_connections: max number of concurrent connections
+        :param max_keepalive_connections: max number of idle connections kept alive
+        :param timeout: default timeout in seconds for every call, None means no timeout
+        """
+        if not djapi and raise_on_error_code:
+            raise ValueError("Cannot use raise_on_error_code when djapi is False")
+        if client is None:
+            if httpx is None:
+                raise ImportError("AsyncJSONRequester requires httpx, install it with `pip install httpx`")
+            limits = httpx.Limits(max_connections=max_connections,
+                                  max_keepalive_connections=max_keepalive_connections)
+            client = httpx.AsyncClient(limits=limits, timeout=timeout)
+        self._djapi = djapi
+        self._raise_on_error_code = raise_on_error_code
+        self._client = client
+
+    @property
+    def client(self):
+        return self._client
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    async def request(self, method, url, **kwargs) -> JSONResult:
+        start = time.monotonic()
+        try:
+            res = await self._client.request(method, url, **kwargs)
+        except Exception as e:
+            raise ProjectError.REMOTE_SERVER_ERROR(str(e) or e.__class__.__name__)
+        try:
+            body = serializer.loads(res.content)
+        except Exception as e:
+            raise _invalid_json_error(e, res.content)
+        if not self._djapi:
+            return JSONResult(body, None, None, None, None, res.status_code, res.headers, time.monotonic() - start)
+        code, error_detail = body['code'], body.get('error_detail')
+        if self._raise_on_error_code and code != _SUCCESS_CODE:
+            _raise_for_code(code, error_detail)
+        return JSONResult(body, code, body['msg'], body['data'], error_detail, res.status_code, res.headers,
+                          time.monotonic() - start)
+
+    async def get(self, url, params=None, **kwargs) -> JSONResult:
+        return await self.request('GET', url, params=params, **kwargs)
+
+    async def post(self, url, data=None, json=None, **kwargs) -> JSONResult:
+        return await self.request('POST', url, data=data, json=json, **kwargs)
+
+    async def put(self, url, data=None, json=None, **kwargs) -> JSONResult:
+        return await self.request('PUT', url, data=data, json=json, **kwargs)
+
+    async def patch(self, url, data=None, json=None, **kwargs) -> JSONResult:
+        return await self.request('PATCH', url, data=data, json=json, **kwargs)
+
+    async def delete(self, url, **kwargs) -> JSONResult:
+        return await self.request('DELETE', url, **kwargs)
+
+    @staticmethod
+    async def gather(*calls, limit: int = 10, deadline: float = None, return_exceptions=False) -> list:
+        """
+        concurrently run calls such as requester.get(url), results are returned in the same order
+        :param calls: awaitables
+        :param limit: max number of calls running at the same time
+        :param deadline: seconds each call may take, ProjectError.REMOTE_SERVER_ERROR is raised when exceeded
+        :param return_exceptions: return exceptions as results instead of raising the first one
+        """
+        semaphore = asyncio.Semaphore(limit)
+
+        async def run(call):
+            async with semaphore:
+                try:
+                    return await asyncio.wait_for(call, deadline)
+                except asyncio.TimeoutError:
+                    raise ProjectError.REMOTE_SERVER_ERROR(f"Remote call did not finish in {deadline} seconds")
+
+        return await asyncio.gather(*map(run, calls), return_exceptions=return_exceptions)
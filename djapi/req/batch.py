@@ -0,0 +1,169 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlencode
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connections
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+from django.utils.module_loading import import_string
+from djapi import serializer
+from djapi.error import ProjectError, ProjectExceptionMiddleware
+from djapi.error.middleware import iscoroutinefunction
+from djapi.req.request import require_POST_api
+from djapi.req.response import _SUCCESS_ENVELOPE
+from djapi.req.schema import Field, Schema
+
+__all__ = ['batch_dispatcher']
+
+_METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+# 子请求不继承的请求头：条件请求和压缩会让子响应无法直接拼接到批量响应中
+_DROPPED_HEADERS = frozenset(['HTTP_ACCEPT_ENCODING', 'HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE',
+                              'HTTP_IF_MATCH', 'HTTP_IF_UNMODIFIED_SINCE', 'CONTENT_TYPE', 'CONTENT_LENGTH'])
+# 由中间件设置在request上、子请求直接沿用的属性
+_INHERITED_ATTRS = ('user', 'auth', 'session')
+
+
+def _build_request(parent, method, path, params, body) -> WSGIRequest:
+    environ = {k: v for k, v in parent.META.items() if k not in _DROPPED_HEADERS}
+    content = b'' if body is None else serializer.dumps(body)
+    environ.update({
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': urlencode(params, doseq=True) if params else '',
+        'wsgi.input': BytesIO(content),
+        'CONTENT_LENGTH': str(len(content)),
+    })
+    if body is not None:
+        environ['CONTENT_TYPE'] = 'application/json'
+    request = WSGIRequest(environ)
+    for attr in _INHERITED_ATTRS:
+        if attr in parent.__dict__:
+            request.__dict__[attr] = parent.__dict__[attr]
+    return request
+
+
+def _view_hooks() -> list:
+    """
+    settings.MIDDLEWARE中各中间件的process_view，按配置的顺序排列
+    """
+    hooks = []
+    for middleware_path in settings.MIDDLEWARE:
+        try:
+            middleware = import_string(middleware_path)(lambda request: None)
+        except MiddlewareNotUsed:
+            continue
+        process_view = getattr(middleware, 'process_view', None)
+        if process_view is not None:
+            hooks.append(async_to_sync(process_view) if iscoroutinefunction(process_view) else process_view)
+    return hooks
+
+
+def _item_body(response) -> bytes:
+    content = b''.join(response.streaming_content) if response.streaming else response.content
+    if response.get('Content-Type', '').startswith('application/json') and content:
+        return content
+    # 非JSON响应按HTTP状态码生成信封，与ProjectError中HTTP错误的错误码一致
+    if response.status_code < 400:
+        return serializer.dumps({**_SUCCESS_ENVELOPE, 'data': content.decode(errors='replace')})
+    return serializer.dumps({'msg': response.reason_phrase, 'code': response.status_code,
+                             'data': content.decode(errors='replace')})
+
+
+_BATCH_SCHEMA = Schema({
+    'requests': Field(items=Field(fields={
+        'method': Field(str, allowed_values=_METHODS),
+        'path': Field(str),
+        'params': Field(dict, allow_empty=True),
+        'body': Field(object, allow_empty=True),
+    })),
+    'parallel': Field(bool, allow_empty=True, default=False),
+})
+
+
+def batch_dispatcher(max_items: int = 20, max_workers: int = 4, allowed_prefixes=None):
+    """
+    生成批量请求视图，一次HTTP请求执行多个API调用，子请求不经过网络，直接由URL解析到视图执行，
+    视图抛出的异常按ProjectExceptionMiddleware的规则转为错误响应，每个子请求的结果互不影响
+
+    子请求不执行中间件的process_request、process_response，但执行视图前会按settings.MIDDLEWARE的顺序调用各中间件的
+    process_view，LoginRequiredMiddleware、CsrfViewMiddleware等在process_view中实现的访问控制对子请求同样有效，
+    process_view返回响应时不执行视图，该响应作为子请求的结果；只在process_request中检查权限的中间件对子请求无效，
+    这时应通过allowed_prefixes限制子请求可以访问的路径
+
+    请求体::
+
+        {"requests": [{"method": "GET", "path": "/users/", "params": {"page": 2}},
+                      {"method": "POST", "path": "/orders/", "body": {"item": 1}}],
+         "parallel": false}
+
+    响应的data为每个子请求的响应信封（msg、code、data），顺序与requests相同
+    子请求沿用批量请求的请求头以及request.user、request.session
+
+    用法::
+
+        path('batch/', batch_dispatcher(max_items=50))
+
+    :param max_items: 一次最多包含的子请求个数
+    :param max_workers: parallel为true时并发执行子请求的线程数，子请求之间必须互不依赖
+    :param allowed_prefixes: 子请求可以访问的路径前缀，例如['/api/']，其它路径返回PERMISSION_DENIED，默认不限制
+    """
+    middleware = ProjectExceptionMiddleware(lambda request: None)
+    view_hooks = _view_hooks()
+    if allowed_prefixes is not None:
+        allowed_prefixes = tuple(allowed_prefixes)
+
+    def call(request, item) -> bytes:
+        method, path = item['method'], item['path']
+        sub_request = _build_request(request, method, path, item.get('params'), item.get('body'))
+        try:
+            if allowed_prefixes is not None and not path.startswith(allowed_prefixes):
+                raise ProjectError.PERMISSION_DENIED(f'"{path}" is not allowed in batch requests')
+            try:
+                match = resolve(path)
+            except Resolver404:
+                raise ProjectError.NOT_FOUND(f'"{path}" not found')
+            if match.func is view:
+                raise ProjectError.BAD_REQUEST("Batch requests cannot be nested")
+            sub_request.resolver_match = match
+            for process_view in view_hooks:
+                response = process_view(sub_request, match.func, match.args, match.kwargs)
+                if response is not None:
+                    break
+            else:
+                func = match.func
+                if iscoroutinefunction(func):
+                    func = async_to_sync(func)
+                response = func(sub_request, *match.args, **match.kwargs)
+        except Exception as e:
+            response = middleware.process_exception(sub_request, e)
+        return _item_body(response)
+
+    def call_in_thread(request, item) -> bytes:
+        try:
+            return call(request, item)
+        finally:
+            # 线程池中的线程各自打开数据库连接，执行完后关闭
+            connections.close_all()
+
+    @require_POST_api
+    def view(request):
+        data = _BATCH_SCHEMA.validate(request)
+        items = data['requests']
+        if len(items) > max_items:
+            raise ProjectError.INVALID_FIELD_VALUE(f'Field "requests" should contain at most {max_items} items')
+        if data['parallel'] and len(items) > 1:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+                bodies = list(executor.map(lambda item: call_in_thread(request, item), items))
+        else:
+            bodies = [call(request, item) for item in items]
+        # 子响应已经是序列化好的JSON，直接拼接，不再解析
+        envelope = serializer.dumps({**_SUCCESS_ENVELOPE, 'data': []})
+        separator = serializer.dumps([0, 0])[2:-2]
+        return HttpResponse(envelope[:-2] + separator.join(bodies) + envelope[-2:], content_type='application/json')
+
+    return view
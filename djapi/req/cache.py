@@ -0,0 +1,180 @@
+import hashlib
+import time
+import uuid
+from functools import wraps
+from wsgiref.util import is_hop_by_hop
+
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import cc_delim_re, get_conditional_response, patch_vary_headers
+from django.utils.http import parse_http_date_safe
+from djapi.error.middleware import iscoroutinefunction
+from djapi.req.compression import compress_response, negotiate_encoding
+from djapi.req.schema import Schema
+
+__all__ = ['cache_response', 'invalidate_tags']
+
+_KEY_PREFIX = 'djapi:response:'
+_TAG_PREFIX = 'djapi:tag:'
+_LOCK_SUFFIX = ':lock'
+_VARY_SUFFIX = ':vary'
+# 等待其它请求生成响应时的轮询间隔（秒）
+_POLL_INTERVAL = 0.02
+
+
+def _tag_versions(cache, tags) -> list:
+    """
+    每个标签对应一个版本号，标签失效时更换版本号，包含该标签的缓存键随之改变
+    """
+    if not tags:
+        return []
+    keys = [_TAG_PREFIX + tag for tag in tags]
+    versions = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in versions}
+    if missing:
+        # 其它进程可能同时创建了版本号，以先写入的为准
+        for key, version in missing.items():
+            cache.add(key, version, None)
+        versions.update(cache.get_many(list(missing)))
+    return [versions.get(key, '') for key in keys]
+
+
+def invalidate_tags(*tags, cache_alias: str = 'default'):
+    """
+    使带有这些标签的缓存响应全部失效，一般在数据被修改后调用
+    """
+    caches[cache_alias].set_many({_TAG_PREFIX + tag: uuid.uuid4().hex for tag in tags}, None)
+
+
+def cache_response(params=None, ttl: float = 60, stale_ttl: float = 0, tags=(), lock_timeout: float = 10,
+                   cache_alias: str = 'default', compress: bool = False):
+    """
+    缓存GET视图的json_response，缓存键由校验后的查询参数生成，参数顺序、写法不同但值相同的请求共用缓存
+    缓存命中时直接返回保存的响应体和响应头（hop-by-hop头除外），不执行视图，也不需要重新序列化
+    与Django的缓存中间件一样，响应的Vary头列出的请求头计入缓存键，视图读取了session（例如request.user）时按Cookie分别缓存，
+    通过Authorization等其它方式认证、响应与用户相关的视图需要自行设置Vary，例如patch_vary_headers(response, ['Authorization'])
+    设置了cookie或者Vary为*的响应不缓存
+
+    用法::
+
+        @require_GET_api
+        @cache_response({'ids': Field(ListParam(int)), 'page': Field(int, default=1)}, ttl=30, stale_ttl=300,
+                        tags=lambda values: ['products'])
+        def view(request):
+            ...
+
+        invalidate_tags('products')
+
+    :param params: 决定响应内容的查询参数，Schema(source='query')或{字段名: Field}，参数校验失败时返回错误，不缓存
+    :param ttl: 缓存的有效秒数
+    :param stale_ttl: 缓存过期后仍可返回的秒数，期间由一个请求重新执行视图，其它请求直接返回旧的响应
+    :param tags: 标签列表，或以校验后的参数为参数、返回标签列表的函数，通过invalidate_tags使缓存失效
+    :param lock_timeout: 执行视图的最长秒数，缓存不存在时只有一个请求执行视图，其它请求最多等待这么久
+    :param cache_alias: 使用的Django缓存
+    :param compress: 是否按Accept-Encoding压缩响应，每种编码分别缓存压缩后的响应体，命中时不需要再压缩
+    """
+    if params is None:
+        params = {}
+    schema = params if isinstance(params, Schema) else Schema(params, 'query')
+    if schema.source != 'query':
+        raise ValueError("cache_response only supports query parameters")
+
+    def decorator(func):
+        if iscoroutinefunction(func):
+            raise TypeError("cache_response does not support async views")
+        view_name = f'{func.__module__}.{func.__qualname__}'
+
+        @wraps(func)
+        def inner(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return func(request, *args, **kwargs)
+            cache = caches[cache_alias]
+            values = schema.validate(request)
+            view_tags = tags(values) if callable(tags) else tags
+            encoding = negotiate_encoding(request) if compress else None
+            normalized = repr((args, sorted(kwargs.items()), sorted(values.items()), _tag_versions(cache, view_tags),
+                               encoding))
+            base_key = _KEY_PREFIX + view_name + ':' + hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+            lock_key = base_key + _LOCK_SUFFIX
+            vary_key = base_key + _VARY_SUFFIX
+
+            def get_entry():
+                # 先取得上次响应的Vary头，再按这些请求头的值查找
+                return cache.get(_varied_key(base_key, request, cache.get(vary_key, ())))
+
+            entry = get_entry()
+            if entry is not None:
+                if entry[0] > time.time():
+                    return _to_response(request, entry)
+                # 已过期但仍可返回，只有拿到锁的请求重新执行视图
+                if not cache.add(lock_key, 1, lock_timeout):
+                    return _to_response(request, entry)
+            elif not cache.add(lock_key, 1, lock_timeout):
+                # 其它请求正在生成响应，等待其结果，超时后自己执行视图
+                # 持锁的请求出错或者响应不能缓存时锁被释放，由一个等待的请求拿到锁重新执行视图
+                deadline = time.monotonic() + lock_timeout
+                while True:
+                    time.sleep(_POLL_INTERVAL)
+                    entry = get_entry()
+                    if entry is not None:
+                        return _to_response(request, entry)
+                    if cache.get(lock_key) is None and cache.add(lock_key, 1, lock_timeout):
+                        break
+                    if time.monotonic() >= deadline:
+                        return func(request, *args, **kwargs)
+            try:
+                response = func(request, *args, **kwargs)
+                if isinstance(response, HttpResponse) and response.status_code == 200:
+                    if compress:
+                        compress_response(request, response, encoding=encoding)
+                    # 视图自行压缩、但编码没有计入缓存键的响应不能缓存
+                    if response.get('Content-Encoding', encoding) != encoding or response.cookies:
+                        return response
+                    vary = _vary_headers(request, response, compress)
+                    if vary is None:
+                        return response
+                    headers = {name: value for name, value in response.items() if not is_hop_by_hop(name)}
+                    entry = (time.time() + ttl, response.content, headers)
+                    cache.set_many({vary_key: vary, _varied_key(base_key, request, vary): entry}, ttl + stale_ttl)
+                return response
+            finally:
+                cache.delete(lock_key)
+
+        return inner
+
+    return decorator
+
+
+def _vary_headers(request, response, compress):
+    """
+    响应随之变化的请求头，Vary为*时返回None
+    """
+    session = getattr(request, 'session', None)
+    if session is not None and session.accessed:
+        # 与SessionMiddleware一样，读取了session的响应按Cookie分别缓存
+        patch_vary_headers(response, ('Cookie',))
+    vary = {header.strip().lower() for header in cc_delim_re.split(response.get('Vary', '')) if header.strip()}
+    if '*' in vary:
+        return None
+    if compress:
+        # 协商后的编码已经计入缓存键
+        vary.discard('accept-encoding')
+    return tuple(sorted(vary))
+
+
+def _varied_key(base_key, request, vary) -> str:
+    if not vary:
+        return base_key
+    values = repr([request.META.get('HTTP_' + header.upper().replace('-', '_')) for header in vary])
+    return base_key + ':' + hashlib.blake2b(values.encode(), digest_size=16).hexdigest()
+
+
+def _to_response(request, entry) -> HttpResponse:
+    _, body, headers = entry
+    response = HttpResponse(body, headers=headers)
+    etag, last_modified = headers.get('ETag'), headers.get('Last-Modified')
+    if etag is None and last_modified is None:
+        return response
+    # 缓存的响应带有ETag或Last-Modified时同样支持条件请求
+    return get_conditional_response(request, etag=etag, last_modified=last_modified and parse_http_date_safe(
+        last_modified), response=response)
@@ -0,0 +1,166 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from djapi.error import ProjectError
+
+__all__ = ['CircuitBreaker', 'Bulkhead']
+
+logger = logging.getLogger('django')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class _HostCircuit:
+    __slots__ = ('state', 'buckets', 'opened_at', 'trials')
+
+    def __init__(self):
+        self.state = CLOSED
+        # 每秒一个桶: [秒, 成功次数, 失败次数]
+        self.buckets = deque()
+        self.opened_at = 0.0
+        self.trials = 0
+
+
+class CircuitBreaker:
+    """
+    按host统计远程调用的失败率，失败率过高时熔断，熔断期间的调用直接失败，不再等待超时
+    状态: closed（正常）-> open（熔断）-> half_open（试探）-> closed或open
+    连接错误、超时和5xx响应计为失败
+    """
+
+    def __init__(self, failure_rate: float = 0.5, window: int = 10, min_calls: int = 10, open_seconds: float = 30,
+                 half_open_calls: int = 1, on_state_change=None):
+        """
+        :param failure_rate: 熔断的失败率，0~1之间
+        :param window: 统计失败率的时间窗口（秒）
+        :param min_calls: 窗口内调用次数达到min_calls才计算失败率
+        :param open_seconds: 熔断持续的秒数，之后进入half_open
+        :param half_open_calls: half_open时允许同时进行的试探调用数，试探成功后恢复，失败则再次熔断
+        :param on_state_change: on_state_change(host, 原状态, 新状态)，例如记录日志或上报监控
+        """
+        self.failure_rate = failure_rate
+        self.window = window
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.on_state_change = on_state_change
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def before_call(self, host: str):
+        """
+        调用前检查，熔断时抛出ProjectError.REMOTE_SERVER_ERROR
+        """
+        changed = None
+        with self._lock:
+            circuit = self._hosts.get(host)
+            if circuit is None:
+                circuit = self._hosts[host] = _HostCircuit()
+            if circuit.state == OPEN:
+                remaining = circuit.opened_at + self.open_seconds - time.monotonic()
+                if remaining > 0:
+                    raise ProjectError.REMOTE_SERVER_ERROR(
+                        f"Circuit breaker for {host} is open, calls are rejected for {remaining:.1f} more seconds")
+                changed = self._transition(circuit, HALF_OPEN)
+            if circuit.state == HALF_OPEN:
+                if circuit.trials >= self.half_open_calls:
+                    raise ProjectError.REMOTE_SERVER_ERROR(
+                        f"Circuit breaker for {host} is half open, waiting for trial calls to finish")
+                circuit.trials += 1
+        self._notify(host, changed)
+
+    def record(self, host: str, success: bool):
+        """
+        记录调用结果
+        """
+        changed = None
+        now = time.monotonic()
+        with self._lock:
+            circuit = self._hosts.get(host)
+            if circuit is None:
+                return
+            if circuit.state == HALF_OPEN:
+                circuit.trials = max(circuit.trials - 1, 0)
+                changed = self._transition(circuit, CLOSED if success else OPEN, now)
+            elif circuit.state == CLOSED:
+                second = int(now)
+                buckets = circuit.buckets
+                while buckets and buckets[0][0] <= second - self.window:
+                    buckets.popleft()
+                if not buckets or buckets[-1][0] != second:
+                    buckets.append([second, 0, 0])
+                buckets[-1][1 if success else 2] += 1
+                if not success:
+                    failures = sum(x[2] for x in buckets)
+                    total = failures + sum(x[1] for x in buckets)
+                    if total >= self.min_calls and failures >= total * self.failure_rate:
+                        changed = self._transition(circuit, OPEN, now)
+        self._notify(host, changed)
+
+    def _transition(self, circuit, state, now=None):
+        old = circuit.state
+        if old == state:
+            return None
+        circuit.state = state
+        if state == OPEN:
+            circuit.opened_at = time.monotonic() if now is None else now
+        else:
+            circuit.trials = 0
+            circuit.buckets.clear()
+        return old, state
+
+    def _notify(self, host, changed):
+        if changed is None:
+            return
+        logger.warning("Circuit breaker for %s changed from %s to %s", host, *changed)
+        if self.on_state_change is not None:
+            self.on_state_change(host, *changed)
+
+    def state(self, host: str) -> str:
+        circuit = self._hosts.get(host)
+        return CLOSED if circuit is None else circuit.state
+
+    def snapshot(self) -> dict:
+        """
+        :return: {host: {'state': 状态, 'successes': 窗口内成功次数, 'failures': 窗口内失败次数}}
+        """
+        with self._lock:
+            return {host: {'state': c.state, 'successes': sum(x[1] for x in c.buckets),
+                           'failures': sum(x[2] for x in c.buckets)} for host, c in self._hosts.items()}
+
+
+class Bulkhead:
+    """
+    限制每个host同时进行的调用数，慢服务只能占用有限的工作线程
+    """
+
+    def __init__(self, max_concurrent: int = 10, timeout: float = 0):
+        """
+        :param max_concurrent: 每个host最多同时进行的调用数
+        :param timeout: 达到上限时等待的秒数，超时抛出ProjectError.REMOTE_SERVER_ERROR
+        """
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, host):
+        semaphore = self._semaphores.get(host)
+        if semaphore is None:
+            with self._lock:
+                semaphore = self._semaphores.setdefault(host, threading.BoundedSemaphore(self.max_concurrent))
+        return semaphore
+
+    def acquire(self, host: str):
+        semaphore = self._semaphore(host)
+        acquired = semaphore.acquire(timeout=self.timeout) if self.timeout else semaphore.acquire(blocking=False)
+        if not acquired:
+            raise ProjectError.REMOTE_SERVER_ERROR(
+                f"Too many concurrent calls to {host}, at most {self.max_concurrent} are allowed")
+
+    def release(self, host: str):
+        self._semaphore(host).release()
@@ -0,0 +1,192 @@
+import zlib
+
+from django.http import HttpRequest
+from django.utils.cache import patch_vary_headers
+from djapi.env import get_int
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+__all__ = ['available_encodings', 'negotiate_encoding', 'compress_response']
+
+
+class _Gzip:
+    name = 'gzip'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        compressor = self.compressor()
+        return compressor.compress(data) + compressor.finish()
+
+    def compressor(self):
+        return _ZlibCompressor(zlib.compressobj(self.level, zlib.DEFLATED, 31))
+
+
+class _ZlibCompressor:
+    __slots__ = ('_obj',)
+
+    def __init__(self, obj):
+        self._obj = obj
+
+    def compress(self, data: bytes) -> bytes:
+        # 每个数据块都输出完整的压缩数据，客户端可以立即解压
+        return self._obj.compress(data) + self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._obj.flush(zlib.Z_FINISH)
+
+
+class _Brotli:
+    name = 'br'
+
+    def __init__(self, quality=4):
+        self.quality = quality
+
+    def compress(self, data: bytes) -> bytes:
+        return brotli.compress(data, quality=self.quality)
+
+    def compressor(self):
+        return _BrotliCompressor(brotli.Compressor(quality=self.quality))
+
+
+class _BrotliCompressor:
+    __slots__ = ('_obj',)
+
+    def __init__(self, obj):
+        self._obj = obj
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.process(data) + self._obj.flush()
+
+    def finish(self) -> bytes:
+        return self._obj.finish()
+
+
+class _Zstd:
+    name = 'zstd'
+
+    def __init__(self, level=3):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def compressor(self):
+        return _ZstdCompressor(zstandard.ZstdCompressor(level=self.level).compressobj())
+
+
+class _ZstdCompressor:
+    __slots__ = ('_obj',)
+
+    def __init__(self, obj):
+        self._obj = obj
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data) + self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+# 按优先级排列，客户端对多个编码的q值相同时选择靠前的
+_CODECS = {}
+if zstandard is not None:
+    _CODECS['zstd'] = _Zstd()
+if brotli is not None:
+    _CODECS['br'] = _Brotli()
+_CODECS['gzip'] = _Gzip()
+
+
+def available_encodings() -> list:
+    """
+    当前环境支持的压缩编码，brotli和zstd需要安装对应的包
+    """
+    return list(_CODECS)
+
+
+def _parse_accept_encoding(header: str) -> dict:
+    accepted = {}
+    for item in header.split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+def negotiate_encoding(request: HttpRequest):
+    """
+    根据Accept-Encoding选择压缩编码，客户端不接受任何可用编码时返回None
+    :return: 编码名，gzip、br或zstd
+    """
+    header = request.META.get('HTTP_ACCEPT_ENCODING')
+    if not header:
+        return None
+    accepted = _parse_accept_encoding(header)
+    wildcard = accepted.get('*', 0.0)
+    best, best_q = None, 0.0
+    for name in _CODECS:
+        q = accepted.get(name, wildcard)
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def compress_response(request: HttpRequest, response, min_size: int = None, encoding: str = None):
+    """
+    按Accept-Encoding压缩响应，流式响应逐块压缩，已经压缩过或小于min_size的响应不压缩
+    压缩后强ETag变为弱ETag，条件请求仍然可以匹配
+    :param min_size: 最小压缩字节数，默认为环境变量DJAPI_COMPRESS_MIN_SIZE，未设置时为1024
+    :param encoding: 已经协商好的编码，不提供时由request的Accept-Encoding决定
+    """
+    if response.has_header('Content-Encoding') or not 200 <= response.status_code < 300:
+        return response
+    if not response.streaming:
+        if min_size is None:
+            min_size = get_int('DJAPI_COMPRESS_MIN_SIZE', default=1024)
+        if len(response.content) < min_size:
+            return response
+    patch_vary_headers(response, ('Accept-Encoding',))
+    codec = _CODECS.get(encoding or negotiate_encoding(request))
+    if codec is None:
+        return response
+    if response.streaming:
+        response.streaming_content = _compress_chunks(codec.compressor(), response.streaming_content)
+        del response['Content-Length']
+    else:
+        content = codec.compress(response.content)
+        if len(content) >= len(response.content):
+            return response
+        response.content = content
+        response['Content-Length'] = str(len(content))
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = 'W/' + etag
+    response['Content-Encoding'] = codec.name
+    return response
+
+
+def _compress_chunks(compressor, chunks):
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
@@ -0,0 +1,198 @@
+import codecs
+import json
+import re
+
+from django.conf import settings
+from django.http import HttpRequest
+from djapi.error import ProjectError
+from djapi.req.request import _JSON_DATA_ATTR, _get_type_name
+from djapi.req.schema import Field, _aggregate, _compile_json_value
+
+__all__ = ['iter_json_array']
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+_NUMBER_CHARS = frozenset('0123456789.eE+-')
+# 缓冲区末尾被截断的字面量最长为"-Infinity"，截断的\uXXXX转义也在这个范围内
+_MAX_TRUNCATED = len('-Infinity')
+
+
+class _StreamReader:
+    """
+    从request的输入流中按块读取JSON文本，只在缓冲区中保留尚未解析的部分
+    """
+
+    def __init__(self, stream, chunk_size: int, max_value_size: int = None):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._max_value_size = max_value_size
+        self._decode = codecs.getincrementaldecoder('utf-8')().decode
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self._stream.read(self._chunk_size)
+        text = self._decode(chunk, final=not chunk)
+        if not chunk:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        return bool(chunk)
+
+    def peek(self) -> str:
+        """
+        跳过空白，返回下一个字符，流结束时返回空字符串
+        """
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f'Expecting "{char}"')
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                # 只有值在缓冲区末尾被截断时才读取更多数据，其它错误立即抛出，不再缓冲剩余的请求体
+                if not self._truncated(e) or not self._more():
+                    raise
+                continue
+            # 数字可能在缓冲区末尾被截断（例如"2."被解析为2），读取更多数据后重新解析
+            if isinstance(value, (int, float)) and (end == len(self.buf) or self.buf[end] in _NUMBER_CHARS) \
+                    and self._more():
+                continue
+            self.pos = end
+            return value
+
+    def _truncated(self, e: json.JSONDecodeError) -> bool:
+        # 未结束的字符串一直延续到缓冲区末尾，错误位置是字符串的开头
+        return e.msg.startswith('Unterminated string') or len(self.buf) - e.pos <= _MAX_TRUNCATED
+
+    def _more(self) -> bool:
+        if not self.fill():
+            return False
+        if self._max_value_size is not None and len(self.buf) - self.pos > self._max_value_size:
+            raise ProjectError.UNPROCESSABLE(
+                f'Request body contains a json value larger than {self._max_value_size} bytes')
+        return True
+
+
+def iter_json_array(request: HttpRequest, field, required_type=object, allow_empty=False,
+                    chunk_size: int = 64 * 1024, max_value_size: int = None):
+    """
+    从输入流中逐个读取JSON请求体顶层数组字段field的元素并校验类型，内存占用与请求体大小无关，适用于批量导入等大请求体
+    单个元素（以及其它顶层字段的值）的大小不能超过max_value_size，否则返回UNPROCESSABLE
+    读取输入流之后request.body将不可用，其它顶层字段可以继续通过get_json_field获取，
+    但位于数组之后的字段要在数组读取完之后才能获取
+
+    用法::
+
+        for item in iter_json_array(request, 'items', dict):
+            ...
+        source = get_json_field(request, 'source', str)
+
+    :param request: HttpRequest
+    :param field: 顶层数组字段名
+    :param required_type: 数组元素的类型，python类，也可以是Field，按Field的声明校验元素
+    :param allow_empty: 字段不存在时是否报错
+    :param chunk_size: 每次从输入流读取的字节数
+    :param max_value_size: 单个值的最大长度（按字符计），默认为settings.DATA_UPLOAD_MAX_MEMORY_SIZE，该设置为None时不限制
+    :return: 生成器，逐个返回数组元素
+    """
+    if request.content_type != 'application/json':
+        raise ProjectError.NOT_ACCEPTABLE("Content-Type must be application/json")
+    if max_value_size is None:
+        max_value_size = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+    return _iter_json_array(request, field, _compile_item(field, required_type), allow_empty, chunk_size,
+                            max_value_size)
+
+
+def _compile_item(field, required_type):
+    if isinstance(required_type, Field):
+        check = _compile_json_value('', required_type)
+
+        def validate(item, i):
+            errors = []
+            item = check(item, errors)
+            if errors:
+                raise _aggregate([(code, f'{field}[{i}]{path}', template) for code, path, template in errors])
+            return item
+
+        return validate
+
+    int_to_float = required_type == float
+    type_name = _get_type_name(required_type)
+
+    def validate(item, i):
+        if int_to_float and isinstance(item, int):
+            item = float(item)
+        if not isinstance(item, required_type):
+            raise ProjectError.WRONG_FIELD_TYPE(f'Item {i} of field "{field}" should be {type_name}')
+        return item
+
+    return validate
+
+
+def _iter_json_array(request, field, validate, allow_empty, chunk_size, max_value_size):
+    reader = _StreamReader(request, chunk_size, max_value_size)
+    json_data = {}
+    # 请求体不再整体读取，其它字段通过缓存提供给get_json_field
+    request.__dict__[_JSON_DATA_ATTR] = (getattr(request, '_body', None), json_data)
+    found = False
+    try:
+        reader.expect('{')
+        if reader.peek() == '}':
+            reader.pos += 1
+        else:
+            while True:
+                key = reader.value()
+                if not isinstance(key, str):
+                    raise ValueError('Expecting property name')
+                reader.expect(':')
+                if key != field:
+                    json_data[key] = reader.value()
+                else:
+                    found = True
+                    if reader.peek() != '[':
+                        raise ProjectError.WRONG_FIELD_TYPE(f'Field "{field}" should be array')
+                    reader.pos += 1
+                    i = 0
+                    if reader.peek() == ']':
+                        reader.pos += 1
+                    else:
+                        while True:
+                            try:
+                                item = reader.value()
+                            except ValueError:
+                                raise ProjectError.NOT_ACCEPTABLE(f'Invalid json at item {i} of field "{field}"')
+                            yield validate(item, i)
+                            char = reader.peek()
+                            reader.pos += 1
+                            if char == ']':
+                                break
+                            if char != ',':
+                                raise ProjectError.NOT_ACCEPTABLE(f'Invalid json after item {i} of field "{field}"')
+                            i += 1
+                char = reader.peek()
+                reader.pos += 1
+                if char == '}':
+                    break
+                if char != ',':
+                    raise ValueError('Expecting "," delimiter')
+        if reader.peek():
+            raise ValueError('Extra data')
+    except ValueError:
+        raise ProjectError.NOT_ACCEPTABLE("Invalid json object")
+    if not found and not allow_empty:
+        raise ProjectError.FIELD_MISSING(f"Field {field} is either missing or empty")
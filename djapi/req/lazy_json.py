@@ -0,0 +1,82 @@
+from collections.abc import Mapping
+
+from djapi import serializer
+from djapi.error import ProjectError
+
+try:
+    import simdjson
+except ImportError:  # pragma: no cover
+    simdjson = None
+
+__all__ = ['LazyJSONObject']
+
+
+class LazyJSONObject(Mapping):
+    """
+    按需解析的JSON对象，基于simdjson：创建时只校验JSON并建立索引，不生成python对象，
+    字段值在第一次访问时才转换为dict、list等，适用于请求体很大、视图只读取其中少数字段的情况，例如webhook
+    字段名重复时与json.loads一样取最后一个
+    """
+
+    def __init__(self, body: bytes):
+        """
+        :param body: utf-8编码的JSON对象
+        :raise ProjectError.NOT_ACCEPTABLE: body不是有效的JSON对象
+        """
+        if simdjson is None:
+            raise ImportError("LazyJSONObject requires pysimdjson, install it with `pip install pysimdjson`")
+        try:
+            # 每个对象使用单独的Parser，Parser在解析下一个文档前不能被其它对象复用
+            doc = simdjson.Parser().parse(body)
+        except ValueError:
+            raise ProjectError.NOT_ACCEPTABLE("Invalid json object")
+        if not isinstance(doc, simdjson.Object):
+            raise ProjectError.NOT_ACCEPTABLE("Request body must be a valid json object")
+        if len(set(doc.keys())) != len(doc):
+            # simdjson按字段名查找时返回第一个，有重复字段时完整转换（as_dict取最后一个）
+            doc = doc.as_dict()
+        self._doc = doc
+        self._values = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        value = self._doc[key]
+        if isinstance(value, simdjson.Object):
+            value = value.as_dict()
+        elif isinstance(value, simdjson.Array):
+            value = value.as_list()
+        self._values[key] = value
+        return value
+
+    def __contains__(self, key):
+        return key in self._doc
+
+    def __iter__(self):
+        return iter(self._doc.keys())
+
+    def __len__(self):
+        return len(self._doc)
+
+    def __repr__(self):
+        return f'<LazyJSONObject: {len(self._doc)} fields, {len(self._values)} decoded>'
+
+    def to_dict(self) -> dict:
+        """
+        转换全部字段
+        """
+        return {key: self[key] for key in self}
+
+
+def _lazy_loads(body: bytes):
+    """
+    按需解析请求体，没有安装pysimdjson、或者包含simdjson不支持的超过64位的整数时完整解析
+    """
+    if simdjson is None:
+        return serializer.loads(body)
+    try:
+        return LazyJSONObject(body)
+    except RuntimeError:
+        return serializer.loads(body)
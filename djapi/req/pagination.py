@@ -0,0 +1,102 @@
+import base64
+import binascii
+import datetime
+import uuid
+from decimal import Decimal
+from functools import reduce
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import HttpRequest, HttpResponse
+from djapi import serializer
+from djapi.error import ProjectError
+from djapi.req.params import Pagination, _DEFAULT_PAGINATION
+from djapi.req.response import json_response
+
+__all__ = ['keyset_paginate', 'keyset_response']
+
+
+def _parse_ordering(ordering) -> tuple:
+    if not ordering:
+        raise ValueError("ordering must contain at least one field")
+    return tuple((name[1:], True) if name.startswith('-') else (name, False) for name in ordering)
+
+
+def _encode_value(value):
+    # DjangoJSONEncoder会把时间截断到毫秒，游标需要完整的值
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (Decimal, uuid.UUID)):
+        return str(value)
+    return value
+
+
+def _encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(serializer.dumps([_encode_value(x) for x in values])).rstrip(b'=').decode()
+
+
+def _decode_cursor(cursor: str, field: str, size: int) -> list:
+    try:
+        values = serializer.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        values = None
+    # 游标中只能是排序字段的值，不能是对象或数组
+    if not isinstance(values, list) or len(values) != size or \
+            not all(isinstance(x, (str, int, float)) for x in values):
+        raise ProjectError.INVALID_FIELD_VALUE(f'Field "{field}" is not a valid cursor')
+    return values
+
+
+def _get_key(row, name):
+    if isinstance(row, dict):
+        return row[name]
+    return reduce(getattr, name.split('__'), row)
+
+
+def keyset_paginate(request: HttpRequest, queryset, ordering, pagination: Pagination = _DEFAULT_PAGINATION):
+    """
+    按游标分页，以上一页最后一行的排序字段值作为查询条件，任意页的查询耗时都与第一页相同
+    page_size和cursor通过get_pagination从查询参数中获取，cursor无效时报错ProjectError.INVALID_FIELD_VALUE
+
+    :param request: HttpRequest
+    :param queryset: QuerySet，返回model实例或者values()的字典（需要包含排序字段）
+    :param ordering: 排序字段，例如 ('-created', 'id')，最后一个字段必须唯一且所有字段都不能为null
+    :param pagination: Pagination，默认page_size为20，最大为100
+    :return: (当前页的数据, 下一页的游标)，没有下一页时游标为None
+    """
+    if isinstance(ordering, str):
+        ordering = (ordering,)
+    keys = _parse_ordering(ordering)
+    page = pagination.parse(request)
+    if page.cursor is None:
+        rows = list(queryset.order_by(*ordering)[:page.page_size + 1])
+    else:
+        values = _decode_cursor(page.cursor, pagination.cursor_field, len(keys))
+        condition = Q()
+        for i, (name, descending) in enumerate(keys):
+            term = Q(**{f'{name}__{"lt" if descending else "gt"}': values[i]})
+            for (previous, _), value in zip(keys[:i], values):
+                term &= Q(**{previous: value})
+            condition |= term
+        try:
+            # 游标中的值与字段类型不符时，在生成或执行查询时报错
+            rows = list(queryset.filter(condition).order_by(*ordering)[:page.page_size + 1])
+        except (ValueError, TypeError, ValidationError):
+            raise ProjectError.INVALID_FIELD_VALUE(f'Field "{pagination.cursor_field}" is not a valid cursor')
+    if len(rows) <= page.page_size:
+        return rows, None
+    rows.pop()
+    return rows, _encode_cursor([_get_key(rows[-1], name) for name, _ in keys])
+
+
+def keyset_response(request: HttpRequest, queryset, ordering, pagination: Pagination = _DEFAULT_PAGINATION,
+                    transform=None) -> HttpResponse:
+    """
+    按游标分页并返回json_response，data为 {'items': 当前页的数据, 'next_cursor': 下一页的游标}
+    :param transform: 将每一行转为可序列化对象的函数，QuerySet为values()时可以不提供
+    其它参数与keyset_paginate相同
+    """
+    rows, next_cursor = keyset_paginate(request, queryset, ordering, pagination)
+    if transform is not None:
+        rows = [transform(row) for row in rows]
+    return json_response({'items': rows, 'next_cursor': next_cursor})
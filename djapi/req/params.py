@@ -0,0 +1,300 @@
+import enum
+from typing import NamedTuple
+
+from django.utils.dateparse import parse_date, parse_datetime
+from djapi.error import ProjectError
+
+__all__ = ['ParamType', 'ListParam', 'RangeParam', 'DateTimeParam', 'DateParam', 'EnumParam',
+           'Page', 'Pagination', 'get_pagination']
+
+# request上缓存的查询参数解析结果: (request.GET, {(字段名, ParamType): 值})
+_PARAM_CACHE_ATTR = '__project_param_cache__'
+
+
+def _get_type_name(class_type):
+    if isinstance(class_type, ParamType):
+        return class_type.type_name
+    if class_type == str:
+        return 'string'
+    if class_type == int:
+        return 'integer'
+    if class_type == float:
+        return 'float'
+    if class_type == bool:
+        return 'boolean'
+    if class_type == object:
+        return 'object'
+    if class_type == list:
+        return 'array'
+
+    return str(class_type)
+
+
+class ParamType:
+    """
+    查询参数的类型，在定义时完成所有准备工作，作为get_param_value的required_type使用::
+
+        getter('ids', required_type=ListParam(int))
+        getter('created', required_type=RangeParam(DateTimeParam()))
+    """
+    type_name = 'string'
+
+    def parse(self, query, field):
+        """
+        :param query: QueryDict
+        :return: 解析后的值，参数不存在或为空时返回None，格式错误时抛出ValueError
+        """
+        return self.convert(query.get(field) or None)
+
+    def convert(self, raw: str):
+        """
+        转换单个字符串，raw为None时返回None
+        """
+        return raw
+
+    def values(self, value) -> tuple:
+        """
+        需要检查allowed_values的值
+        """
+        return value,
+
+    def config(self):
+        """
+        决定解析结果的全部配置，配置相同的实例相等，例如每次调用时新建的ListParam(int)共用request上的缓存
+        返回None时只与自身相等
+        """
+        return None
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        config = self.config()
+        return config is not None and type(self) is type(other) and config == other.config()
+
+    def __hash__(self):
+        config = self.config()
+        return object.__hash__(self) if config is None else hash((type(self), config))
+
+
+class _ScalarParam(ParamType):
+
+    def __init__(self, required_type):
+        self.required_type = required_type
+        self.type_name = _get_type_name(required_type)
+
+    def convert(self, raw):
+        if raw is None:
+            return None
+        if self.required_type is bool:
+            return raw == 'true'
+        return self.required_type(raw)
+
+    def config(self):
+        return self.required_type,
+
+
+_SCALAR_PARAMS = {t: _ScalarParam(t) for t in (int, float, bool, str)}
+
+
+def _as_param_type(required_type) -> ParamType:
+    if isinstance(required_type, ParamType):
+        return required_type
+    param_type = _SCALAR_PARAMS.get(required_type)
+    if param_type is None:
+        raise TypeError(f"{_get_type_name(required_type)} is not supported")
+    return param_type
+
+
+class ListParam(ParamType):
+    """
+    列表，支持逗号分隔和多个同名参数，例如 ?ids=1,2&ids=3
+    """
+
+    def __init__(self, item_type=str, separator=','):
+        """
+        :param item_type: 元素的类型，int、float、bool、str或ParamType
+        :param separator: 分隔符，为None时不拆分
+        """
+        self.item = _as_param_type(item_type)
+        self.separator = separator
+        self.type_name = f'list of {self.item.type_name}'
+
+    def parse(self, query, field):
+        result = []
+        for raw in query.getlist(field):
+            result.extend(self.convert(raw) or ())
+        return result or None
+
+    def convert(self, raw):
+        if raw is None:
+            return None
+        parts = raw.split(self.separator) if self.separator else (raw,)
+        return [self.item.convert(x.strip()) for x in parts if x.strip()] or None
+
+    def values(self, value):
+        return value
+
+    def config(self):
+        return self.item, self.separator
+
+
+class RangeParam(ParamType):
+    """
+    区间，格式为 最小值..最大值，两端都可以省略，例如 ?price=10..100、?price=10..，返回(最小值, 最大值)
+    """
+
+    def __init__(self, item_type=int, separator='..'):
+        self.item = _as_param_type(item_type)
+        self.separator = separator
+        self.type_name = f'range of {self.item.type_name} like "min{separator}max"'
+
+    def convert(self, raw):
+        if raw is None:
+            return None
+        low, sep, high = raw.partition(self.separator)
+        if not sep:
+            raise ValueError(raw)
+        low = self.item.convert(low.strip() or None)
+        high = self.item.convert(high.strip() or None)
+        if low is None and high is None or low is not None and high is not None and low > high:
+            raise ValueError(raw)
+        return low, high
+
+    def values(self, value):
+        return tuple(x for x in value if x is not None)
+
+    def config(self):
+        return self.item, self.separator
+
+
+class DateTimeParam(ParamType):
+    """
+    ISO 8601时间，例如 2020-01-01T08:00:00+08:00
+    """
+    type_name = 'ISO 8601 datetime'
+
+    def convert(self, raw):
+        if raw is None:
+            return None
+        value = parse_datetime(raw)
+        if value is None:
+            raise ValueError(raw)
+        return value
+
+    def config(self):
+        return ()
+
+
+class DateParam(ParamType):
+    """
+    ISO 8601日期，例如 2020-01-01
+    """
+    type_name = 'ISO 8601 date'
+
+    def convert(self, raw):
+        if raw is None:
+            return None
+        value = parse_date(raw)
+        if value is None:
+            raise ValueError(raw)
+        return value
+
+    def config(self):
+        return ()
+
+
+class EnumParam(ParamType):
+    """
+    枚举，参数为枚举的值或名称
+    """
+
+    def __init__(self, enum_class):
+        if not issubclass(enum_class, enum.Enum):
+            raise TypeError(f"{enum_class} is not an Enum")
+        self.enum_class = enum_class
+        self._members = {str(m.value): m for m in enum_class}
+        for m in enum_class:
+            self._members.setdefault(m.name, m)
+        self.type_name = f'one of [{", ".join(str(m.value) for m in enum_class)}]'
+
+    def convert(self, raw):
+        if raw is None:
+            return None
+        try:
+            return self._members[raw]
+        except KeyError:
+            raise ValueError(raw)
+
+    def config(self):
+        return self.enum_class,
+
+
+def _parse_param(request, field, param_type: ParamType):
+    """
+    解析查询参数，结果缓存在request上，同一请求内多次获取同一参数只解析一次
+    """
+    query = request.GET
+    cached = request.__dict__.get(_PARAM_CACHE_ATTR)
+    if cached is None or cached[0] is not query:
+        cached = request.__dict__[_PARAM_CACHE_ATTR] = (query, {})
+    values = cached[1]
+    key = (field, param_type)
+    if key in values:
+        return values[key]
+    try:
+        value = param_type.parse(query, field)
+    except (TypeError, ValueError):
+        raise ProjectError.WRONG_FIELD_TYPE(f'Field "{field}" must be {param_type.type_name}')
+    values[key] = value
+    return value
+
+
+class Page(NamedTuple):
+    page: int
+    page_size: int
+    cursor: str
+
+    @property
+    def offset(self) -> int:
+        return (self.page - 1) * self.page_size
+
+
+class Pagination:
+    """
+    标准分页参数page、page_size和cursor
+    """
+
+    def __init__(self, default_page_size: int = 20, max_page_size: int = 100, page_field='page',
+                 page_size_field='page_size', cursor_field='cursor'):
+        self.default_page_size = default_page_size
+        self.max_page_size = max_page_size
+        self.page_field = page_field
+        self.page_size_field = page_size_field
+        self.cursor_field = cursor_field
+
+    def parse(self, request) -> Page:
+        page = _parse_param(request, self.page_field, _SCALAR_PARAMS[int])
+        page_size = _parse_param(request, self.page_size_field, _SCALAR_PARAMS[int])
+        if page is None:
+            page = 1
+        elif page < 1:
+            raise ProjectError.INVALID_FIELD_VALUE(f'Field "{self.page_field}" should be at least 1')
+        if page_size is None:
+            page_size = self.default_page_size
+        elif not 1 <= page_size <= self.max_page_size:
+            raise ProjectError.INVALID_FIELD_VALUE(
+                f'Field "{self.page_size_field}" should be between 1 and {self.max_page_size}')
+        return Page(page, page_size, _parse_param(request, self.cursor_field, _SCALAR_PARAMS[str]))
+
+
+_DEFAULT_PAGINATION = Pagination()
+
+
+def get_pagination(request, pagination: Pagination = _DEFAULT_PAGINATION) -> Page:
+    """
+    获取分页参数，若发生错误则终止响应
+    :param request: HttpRequest
+    :param pagination: Pagination，默认page_size为20，最大为100
+    :return: Page(page, page_size, cursor)
+    """
+    return pagination.parse(request)
@@ -1,103 +1,373 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode, urlsplit
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from djapi import serializer
+from djapi.env import get_duration
 from djapi.error import ProjectError
+from djapi.req.circuit import Bulkhead, CircuitBreaker
+
+__all__ = ['JSONResult', 'JSONRequester']
+
+_SUCCESS_CODE = ProjectError.SUCCESS.code
+# 只有幂等的方法才会自动重试
+_IDEMPOTENT_METHODS = frozenset(['HEAD', 'GET', 'PUT', 'DELETE', 'OPTIONS', 'TRACE'])
+_RETRY_STATUSES = (502, 503, 504)
+
+
+def _invalid_json_error(e: Exception, content: bytes):
+    try:
+        msg = content.decode()
+    except UnicodeDecodeError:
+        msg = str(content)
+    return ProjectError.REMOTE_SERVER_ERROR(
+        secret_detail=f"{e.__class__.__name__}: {str(e)} (server response was: {msg})")
+
+
+def _raise_for_code(code, error_detail):
+    """
+    将远程djapi服务返回的错误码还原为ProjectError，未定义的错误码作为REMOTE_SERVER_ERROR抛出
+    """
+    try:
+        error = ProjectError[code]
+    except KeyError:
+        error = ProjectError.REMOTE_SERVER_ERROR
+    raise error(error_detail)
+
+
+def _cache_ttl(headers, default_ttl):
+    """
+    根据Cache-Control决定缓存的秒数，返回None时不缓存
+    """
+    cache_control = headers.get('Cache-Control')
+    if not cache_control:
+        return default_ttl
+    directives = {}
+    for item in cache_control.split(','):
+        name, _, value = item.strip().partition('=')
+        directives[name.lower()] = value.strip('"')
+    if 'no-store' in directives:
+        return None
+    if 'no-cache' in directives:
+        # 仍然保存，每次使用前通过ETag确认
+        return 0
+    try:
+        return int(directives['max-age'])
+    except (KeyError, ValueError):
+        return default_ttl
+
+
+class JSONResult:
+    """
+    Result of one remote call. Results are immutable, so they can be passed between threads freely.
+    When the remote server does not use djapi, "code", "msg", "data" and "error_detail" are None,
+    and the decoded response is available as "json".
+    """
+    __slots__ = ('json', 'code', 'msg', 'data', 'error_detail', 'status', 'headers', 'elapsed')
+
+    def __init__(self, json, code, msg, data, error_detail, status, headers, elapsed):
+        """
+        :param json: decoded response
+        :param status: HTTP status code
+        :param headers: response headers, case insensitive
+        :param elapsed: seconds the call took, including waiting for a coalesced call
+        """
+        setattr_ = object.__setattr__
+        setattr_(self, 'json', json)
+        setattr_(self, 'code', code)
+        setattr_(self, 'msg', msg)
+        setattr_(self, 'data', data)
+        setattr_(self, 'error_detail', error_detail)
+        setattr_(self, 'status', status)
+        setattr_(self, 'headers', headers)
+        setattr_(self, 'elapsed', elapsed)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"JSONResult is immutable, cannot set attribute {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"JSONResult is immutable, cannot delete attribute {name}")
+
+    def __repr__(self):
+        return f"<JSONResult status={self.status} code={self.code} msg={self.msg!r}>"
 
-__all__ = ['JSONRequester']
+
+class _CacheEntry:
+    __slots__ = ('expires', 'etag', 'content', 'headers')
+
+    def __init__(self, expires, etag, content, headers):
+        self.expires = expires
+        self.etag = etag
+        self.content = content
+        self.headers = headers
+
+
+class _InflightCall:
+    __slots__ = ('event', 'response', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.response = None
+        self.error = None
+
+
+def _copy_error(error: Exception) -> Exception:
+    """
+    每个共用调用的线程抛出单独的异常对象，不共享traceback
+    """
+    try:
+        return copy.copy(error)
+    except Exception:
+        return ProjectError.REMOTE_SERVER_ERROR(str(error) or error.__class__.__name__)
 
 
 class JSONRequester:
     """
-    Calls remote json API and return data. If the remote server uses djapi, automatically processes error.
+    Calls remote json API and returns a JSONResult. If the remote server uses djapi, automatically processes error.
+    Connections are kept alive in a pooled requests.Session. The requester keeps no per-call state,
+    so one requester can be shared across threads::
+
+        requester = JSONRequester(timeout=5)
+        result = requester.get(url, {'id': 1})
+        print(result.data, result.status, result.elapsed)
     """
 
-    def __init__(self, djapi=True, raise_on_error_code=True):
+    def __init__(self, djapi=True, raise_on_error_code=True, session: requests.Session = None,
+                 pool_connections=10, pool_maxsize=10, host_pool_maxsize: dict = None,
+                 timeout=None, retries=0, backoff_factor=0.3, coalesce=False, cache_size=0, cache_ttl=0,
+                 circuit_breaker: CircuitBreaker = None, bulkhead: Bulkhead = None):
         """
-        :param djapi: whether remote server uses djapi. if not, "code", "data" and "msg"
-                    will not be available, and response data can only be accessed by calling json()
+        :param djapi: whether remote server uses djapi. if not, "code", "data" and "msg" of results
+                    are None, and response data can only be accessed by "json"
         :param raise_on_error_code: if remote server uses djapi,
                     raise ProjectError when 'code' in response is not 0 (Success).
                     if code is not defined in ProjectError, ProjectError.REMOTE_SERVER_ERROR will be raised,
                     with original remote error message and error detail
+        :param session: use this session instead of creating a pooled one, pool and retry options are ignored
+        :param pool_connections: number of hosts to keep connection pools for
+        :param pool_maxsize: max number of kept-alive connections per host
+        :param host_pool_maxsize: per host pool size, e.g. {'https://user-service/': 50}
+        :param timeout: default timeout in seconds for every call, a number or a (connect, read) tuple.
+                    None means the DJAPI_REMOTE_TIMEOUT environment variable (e.g. 5s), no timeout when it is not set
+        :param retries: retry count for connection errors and 502/503/504 responses of idempotent methods
+        :param backoff_factor: sleep backoff_factor * 2 ** (retry count - 1) seconds between retries
+        :param coalesce: concurrent GETs with the same url, params and headers share one call
+        :param cache_size: max number of GET responses kept in an in-process LRU cache, 0 disables the cache.
+                    responses are kept for max-age of the remote Cache-Control header, or cache_ttl when absent,
+                    "no-store" responses are not kept, and expired responses with an ETag are revalidated
+        :param cache_ttl: seconds to keep a response without Cache-Control max-age
+        :param circuit_breaker: per host CircuitBreaker, calls to a host with too many failures
+                    fail fast with ProjectError.REMOTE_SERVER_ERROR instead of waiting for the timeout
+        :param bulkhead: per host Bulkhead limiting concurrent calls, so a slow host cannot take every worker thread
         """
         if not djapi and raise_on_error_code:
             raise ValueError("Cannot use raise_on_error_code when djapi is False")
         self._djapi = djapi
         self._raise_on_error_code = raise_on_error_code
-        self._resp = {}
-        self._code = None
-        self._data = None
-        self._msg = None
-        self._error_detail = None
+        if timeout is None:
+            timeout = get_duration('DJAPI_REMOTE_TIMEOUT', default=0) or None
+        self._timeout = timeout
+        if session is None:
+            session = requests.Session()
+            retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=_RETRY_STATUSES,
+                          allowed_methods=_IDEMPOTENT_METHODS, raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            for prefix, maxsize in (host_pool_maxsize or {}).items():
+                session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=maxsize, max_retries=retry))
+        self._session = session
+        self._cache = OrderedDict() if cache_size else None
+        self._cache_size = cache_size
+        self._cache_ttl = cache_ttl
+        self._inflight = {} if coalesce else None
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+        self._breaker = circuit_breaker
+        self._bulkhead = bulkhead
 
-    @property
-    def json(self):
-        return self._resp
+    def close(self):
+        self._session.close()
 
-    @property
-    def code(self):
-        if not self._djapi:
-            raise ValueError("Cannot use attribute code when djapi is False")
-        return self._code
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     @property
-    def data(self):
-        if not self._djapi:
-            raise ValueError("Cannot use attribute data when djapi is False")
-        return self._data
+    def session(self) -> requests.Session:
+        return self._session
 
     @property
-    def msg(self):
-        if not self._djapi:
-            raise ValueError("Cannot use attribute msg when djapi is False")
-        return self._msg
+    def cache_stats(self) -> dict:
+        """
+        {'hits': 缓存命中次数, 'misses': 未命中次数, 'coalesced': 与其它线程共用一次调用的次数, 'size': 缓存的响应数}
+        """
+        with self._lock:
+            return {**self._stats, 'size': len(self._cache) if self._cache is not None else 0}
 
-    def _clean(self):
-        self._code = None
-        self._msg = None
-        self._data = None
-        self._resp = None
+    def clear_cache(self):
+        if self._cache is not None:
+            with self._lock:
+                self._cache.clear()
 
-    def _process_response(self, requests_func, args, kwargs):
+    def _send(self, requests_func, args, kwargs):
+        if self._timeout is not None:
+            kwargs.setdefault('timeout', self._timeout)
+        if self._breaker is None and self._bulkhead is None:
+            try:
+                return requests_func(*args, **kwargs)
+            except Exception as e:
+                raise ProjectError.REMOTE_SERVER_ERROR(str(e))
+        return self._guarded_send(requests_func, args, kwargs)
+
+    def _guarded_send(self, requests_func, args, kwargs):
+        host = urlsplit(args[0]).netloc
+        breaker, bulkhead = self._breaker, self._bulkhead
+        if bulkhead is not None:
+            bulkhead.acquire(host)
         try:
-            res = requests_func(*args, **kwargs)
+            if breaker is not None:
+                breaker.before_call(host)
+            try:
+                res = requests_func(*args, **kwargs)
+            except Exception as e:
+                if breaker is not None:
+                    breaker.record(host, False)
+                raise ProjectError.REMOTE_SERVER_ERROR(str(e))
+        finally:
+            if bulkhead is not None:
+                bulkhead.release(host)
+        if breaker is not None:
+            breaker.record(host, res.status_code < 500)
+        return res
+
+    def _process_response(self, requests_func, args, kwargs) -> JSONResult:
+        start = time.monotonic()
+        res = self._send(requests_func, args, kwargs)
+        return self._make_result(res.json, res.content, res.status_code, res.headers, start)
+
+    def _make_result(self, loads, content, status, headers, start) -> JSONResult:
+        try:
+            res = loads()
         except Exception as e:
-            self._clean()
-            raise ProjectError.REMOTE_SERVER_ERROR(str(e))
+            raise _invalid_json_error(e, content)
+        if not self._djapi:
+            return JSONResult(res, None, None, None, None, status, headers, time.monotonic() - start)
+        code, error_detail = res['code'], res.get('error_detail')
+        if self._raise_on_error_code and code != _SUCCESS_CODE:
+            _raise_for_code(code, error_detail)
+        return JSONResult(res, code, res['msg'], res['data'], error_detail, status, headers,
+                          time.monotonic() - start)
+
+    def _cache_key(self, url, kwargs):
+        # 只有url、params和headers决定响应的GET才能共用
+        if not kwargs.keys() <= {'params', 'headers', 'timeout'}:
+            return None
+        params = kwargs.get('params')
+        if isinstance(params, dict):
+            params = sorted(params.items())
+        headers = kwargs.get('headers')
+        try:
+            return url, urlencode(params or [], doseq=True), tuple(sorted((headers or {}).items()))
+        except TypeError:
+            return None
+
+    def _shared_get(self, key, url, kwargs) -> tuple:
+        """
+        :return: (status, headers, content)
+        """
+        entry = None
+        if self._cache is not None:
+            with self._lock:
+                entry = self._cache.get(key)
+                if entry is not None:
+                    self._cache.move_to_end(key)
+                    if entry.expires > time.monotonic():
+                        self._stats['hits'] += 1
+                        return 200, entry.headers.copy(), entry.content
+                self._stats['misses'] += 1
+        if self._inflight is None:
+            return self._fetch(key, url, kwargs, entry)
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _InflightCall()
+            else:
+                self._stats['coalesced'] += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise _copy_error(call.error)
+            status, headers, content = call.response
+            return status, headers.copy(), content
         try:
-            res = res.json()
+            call.response = self._fetch(key, url, kwargs, entry)
+            status, headers, content = call.response
+            return status, headers.copy(), content
         except Exception as e:
-            self._clean()
-            try:
-                msg = res.content.decode()
-            except UnicodeDecodeError:
-                msg = str(res.content)
-            raise ProjectError.REMOTE_SERVER_ERROR(
-                secret_detail=f"{e.__class__.__name__}: {str(e)} (server response was: {msg})")
-        self._resp = res
-        if self._djapi:
-            self._code = res['code']
-            self._msg = res['msg']
-            self._data = res['data']
-            self._error_detail = res.get('error_detail')
-        if self._raise_on_error_code:
-            if self._code != ProjectError.SUCCESS.code:
-                try:
-                    raise ProjectError[self._code](self._error_detail)
-                except KeyError:
-                    raise ProjectError.REMOTE_SERVER_ERROR(self._error_detail)
-
-    def get(self, url, params=None, **kwargs):
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.event.set()
+
+    def _fetch(self, key, url, kwargs, entry) -> tuple:
+        if entry is not None and entry.etag:
+            kwargs['headers'] = {**(kwargs.get('headers') or {}), 'If-None-Match': entry.etag}
+        res = self._send(self._session.get, [url], kwargs)
+        if self._cache is None:
+            return res.status_code, res.headers, res.content
+        if res.status_code == 304 and entry is not None:
+            # 304响应只包含变化的头，与缓存的响应头合并
+            headers = entry.headers.copy()
+            headers.update(res.headers)
+            content, etag = entry.content, res.headers.get('ETag') or entry.etag
+        elif res.status_code == 200:
+            headers, content, etag = res.headers, res.content, res.headers.get('ETag')
+        else:
+            return res.status_code, res.headers, res.content
+        ttl = _cache_ttl(res.headers, self._cache_ttl)
+        if ttl is not None and (ttl > 0 or etag):
+            with self._lock:
+                self._cache[key] = _CacheEntry(time.monotonic() + ttl, etag, content, headers)
+                self._cache.move_to_end(key)
+                if len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        return 200, headers, content
+
+    def get(self, url, params=None, **kwargs) -> JSONResult:
         kwargs['params'] = params
-        self._process_response(requests.get, [url], kwargs)
+        key = self._cache_key(url, kwargs) if self._cache is not None or self._inflight is not None else None
+        if key is None:
+            return self._process_response(self._session.get, [url], kwargs)
+        start = time.monotonic()
+        status, headers, content = self._shared_get(key, url, kwargs)
+        # 每次调用单独解析，调用方修改data不会影响缓存和其它线程
+        return self._make_result(lambda: serializer.loads(content), content, status, headers, start)
+
+    def post(self, url, data=None, json=None, **kwargs) -> JSONResult:
+        kwargs['json'] = json
+        kwargs['data'] = data
+        return self._process_response(self._session.post, [url], kwargs)
 
-    def post(self, url, data=None, json=None, **kwargs):
+    def put(self, url, data=None, json=None, **kwargs) -> JSONResult:
         kwargs['json'] = json
         kwargs['data'] = data
-        self._process_response(requests.post, [url], kwargs)
+        return self._process_response(self._session.put, [url], kwargs)
 
-    def patch(self, url, data=None, json=None, **kwargs):
+    def patch(self, url, data=None, json=None, **kwargs) -> JSONResult:
         kwargs['json'] = json
         kwargs['data'] = data
-        self._process_response(requests.patch, [url], kwargs)
+        return self._process_response(self._session.patch, [url], kwargs)
 
-    def delete(self, url, **kwargs):
-        self._process_response(requests.delete, [url], kwargs)
+    def delete(self, url, **kwargs) -> JSONResult:
+        return self._process_response(self._session.delete, [url], kwargs)
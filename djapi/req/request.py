@@ -1,8 +1,13 @@
-import json
+import time
 from functools import partial
 from functools import wraps
 from django.http import HttpRequest
+from djapi import metrics, serializer
 from djapi.error import ProjectError
+from djapi.error.middleware import _MIDDLEWARE_ATTR, iscoroutinefunction
+from djapi.req.lazy_json import LazyJSONObject, _lazy_loads
+from djapi.req.params import ParamType, _as_param_type, _get_type_name, _parse_param
+from djapi.req.upload import _parse_multipart
 from django.core.exceptions import TooManyFieldsSent
 
 __all__ = ['get_param_value', 'get_json_field', 'get_multipart_field',
@@ -12,25 +17,66 @@ __all__ = ['get_param_value', 'get_json_field', 'get_multipart_field',
            'require_POST_api', 'require_PUT_api']
 
 
-def _get_type_name(class_type):
-    if class_type == str:
-        return 'string'
-    if class_type == int:
-        return 'integer'
-    if class_type == float:
-        return 'float'
-    if class_type == bool:
-        return 'boolean'
-    if class_type == object:
-        return 'object'
-    if class_type == list:
-        return 'array'
+_JSON_DATA_ATTR = '__project_json_data__'
 
-    return str(class_type)
 
+def _load_json_data(request, lazy=False):
+    """
+    解析请求体中的JSON对象，结果缓存在request上，同一请求内的所有get_json_field调用共用一次解析
+    缓存以request._body为键，请求体被替换后会重新解析
+    :param lazy: 返回LazyJSONObject，字段在访问时才转换；已经完整解析过时直接返回dict
+    """
+    body = getattr(request, '_body', None)
+    cached = request.__dict__.get(_JSON_DATA_ATTR)
+    if cached is not None and cached[0] is body:
+        json_data = cached[1]
+        if lazy or not isinstance(json_data, LazyJSONObject):
+            return json_data
+        # 之前按需解析过，需要完整数据时解析其余字段
+        json_data = json_data.to_dict()
+        request.__dict__[_JSON_DATA_ATTR] = (body, json_data)
+        return json_data
+    json_data = {}
+    loads = _lazy_loads if lazy else serializer.loads
+    try:
+        if request.content_type != 'application/json':
+            raise TypeError
+        body = request.body
+        if body:
+            if metrics.sink is None:
+                json_data = loads(body)
+            else:
+                start = time.perf_counter()
+                json_data = loads(body)
+                metrics.record('parse', time.perf_counter() - start)
+            if not isinstance(json_data, (dict, LazyJSONObject)):
+                raise ProjectError.NOT_ACCEPTABLE("Request body must be a valid json object")
+    except TypeError:
+        raise ProjectError.NOT_ACCEPTABLE("Content-Type must be application/json")
+    except ValueError:
+        raise ProjectError.NOT_ACCEPTABLE("Invalid json object")
+    request.__dict__[_JSON_DATA_ATTR] = (body, json_data)
+    return json_data
+
+
+def _preload_json(request, *args, lazy=False, **kwargs):
+    # 开启统计时先解析请求体，解析时间单独计入parse
+    _load_json_data(request, lazy)
+
+
+def _preload_multipart(request, *args, **kwargs):
+    start = time.perf_counter()
+    try:
+        _parse_multipart(request)
+    except TooManyFieldsSent:
+        # 再次访问request.POST只会得到空值，在这里报告错误
+        raise ProjectError.UNPROCESSABLE("Too many fields sent")
+    metrics.record('parse', time.perf_counter() - start)
 
+
+@metrics.timed('validation', before=_preload_json)
 def get_json_field(request, field, required_type=object, allow_empty=False, allowed_values=None,
-                   default=None):
+                   default=None, lazy=False):
     """
     获取JSON中的字段值，若发生错误则终止响应
     :param request: HttpRequest
@@ -39,24 +85,11 @@ def get_json_field(request, field, required_type=object, allow_empty=False, allo
     :param allow_empty: 是否可以为null或者为空白
     :param allowed_values: field的可取值范围，为一个list或元组，field只能选取中的值。为None或者空时不限制取值
     :param default: 如果field不存在时的默认值
+    :param lazy: 按需解析请求体，只转换访问到的顶层字段，适用于很大、但只读取少数字段的请求体，
+                 需要安装pysimdjson，否则与lazy=False相同
     :return: 字段的值
     """
-    attr = '__project_json_data__'
-    if not hasattr(request, attr):
-        json_data = {}
-        try:
-            if request.content_type != 'application/json':
-                raise TypeError
-            if request.body:
-                json_data = json.loads(request.body)
-                if not isinstance(json_data, dict):
-                    raise ProjectError.NOT_ACCEPTABLE("Request body must be a valid json object")
-        except TypeError:
-            raise ProjectError.NOT_ACCEPTABLE("Content-Type must be application/json")
-        except json.JSONDecodeError:
-            raise ProjectError.NOT_ACCEPTABLE("Invalid json object")
-    else:
-        json_data = getattr(request, attr)
+    json_data = _load_json_data(request, lazy)
     value = json_data.get(field)
     if isinstance(value, (dict, list, str)) and not value and not allow_empty:
         if isinstance(value, required_type):
@@ -79,15 +112,17 @@ def get_json_field(request, field, required_type=object, allow_empty=False, allo
         raise ProjectError.WRONG_FIELD_TYPE(f'Field "{field}" should be {_get_type_name(required_type)}')
 
 
-def json_field_getter(request: HttpRequest):
+def json_field_getter(request: HttpRequest, lazy=False):
     """
     :param
     request: HttpRequest对象
+    :param lazy: 按需解析请求体，见get_json_field
     """
 
-    return partial(get_json_field, request)
+    return partial(get_json_field, request, lazy=lazy)
 
 
+@metrics.timed('validation', before=_preload_multipart)
 def get_multipart_field(request: HttpRequest, field, required_type=bytes, allow_empty=False, allowed_values=None,
                         default=None):
     """
@@ -108,6 +143,7 @@ def get_multipart_field(request: HttpRequest, field, required_type=bytes, allow_
             raise TypeError('Cannot use "allowed_values" when required_type is list')
         if not request.content_type.startswith('multipart/form-data'):
             raise ProjectError.NOT_ACCEPTABLE("Content-Type must be multipart/form-data")
+        _parse_multipart(request)
         if required_type == bytes:
             value = request.FILES.get(field)
         elif required_type == list:
@@ -140,6 +176,7 @@ def multipart_getter(request: HttpRequest):
     return partial(get_multipart_field, request)
 
 
+@metrics.timed('validation')
 def get_param_value(request: HttpRequest, field: str, allow_empty=True, allowed_values=None, required_type=None,
                     default=None):
     """
@@ -148,36 +185,31 @@ def get_param_value(request: HttpRequest, field: str, allow_empty=True, allowed_
     :param field: field name
     :param allow_empty:
     :param allowed_values: a list or a tuple of values
-    :param required_type: cast the value to this type
+    :param required_type: cast the value to this type, int, float, bool, str or a ParamType such as ListParam(int)
     :param default:
     """
 
-    value = request.GET.get(field)
-    if default is not None and required_type:
-        assert isinstance(default, required_type)
-    if not value:
-        value = None
     if required_type:
-        assert required_type in (int, float, bool, str)
-        if value is not None:
-            try:
-                if required_type is bool:
-                    value = value == str('true')
-                else:
-                    value = required_type(value)
-            except (TypeError, ValueError):
-                raise ProjectError.WRONG_FIELD_TYPE(f'Field "{field}" must be {_get_type_name(required_type)}')
+        param_type = _as_param_type(required_type)
+        if default is not None and not isinstance(required_type, ParamType) and \
+                not isinstance(default, required_type):
+            raise TypeError(f'default of field "{field}" should be {_get_type_name(required_type)}')
+        value = _parse_param(request, field, param_type)
+    else:
+        param_type = None
+        value = request.GET.get(field) or None
 
     if value is None:
         if allow_empty:
             return default
         raise ProjectError.FIELD_MISSING(f"Field {field} is either missing of empty")
-    elif allowed_values is not None and value not in allowed_values:
-        choices = ", ".join(map(lambda x: str(x), allowed_values))
-        msg = f"""Value of field {field} can only be one of [{choices}], but {value} was given."""
-        raise ProjectError.INVALID_FIELD_VALUE(msg)
-    else:
-        return value
+    elif allowed_values is not None:
+        for item in (param_type.values(value) if param_type is not None else (value,)):
+            if item not in allowed_values:
+                choices = ", ".join(map(lambda x: str(x), allowed_values))
+                msg = f"""Value of field {field} can only be one of [{choices}], but {item} was given."""
+                raise ProjectError.INVALID_FIELD_VALUE(msg)
+    return value
 
 
 def param_field_getter(request: HttpRequest):
@@ -185,7 +217,26 @@ def param_field_getter(request: HttpRequest):
 
 
 def require_methods_api(request_methods_list):
+    """
+    限制视图允许的请求方法，同时支持同步和异步视图
+    ASGI下异步视图抛出的异常由ProjectExceptionMiddleware在事件循环中直接转为响应，不再切换到线程池
+    """
     def decorator(func):
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_inner(request, *args, **kwargs):
+                try:
+                    if request.method not in request_methods_list:
+                        raise ProjectError.METHOD_NOT_ALLOWED(f"不允许{request.method}方法")
+                    return await func(request, *args, **kwargs)
+                except Exception as e:
+                    middleware = request.__dict__.get(_MIDDLEWARE_ATTR)
+                    if middleware is None:
+                        raise
+                    return middleware.process_exception(request, e)
+
+            return async_inner
+
         @wraps(func)
         def inner(request, *args, **kwargs):
             if request.method not in request_methods_list:
@@ -1,16 +1,117 @@
+import hashlib
+from itertools import chain, islice
+from types import MappingProxyType
+from djapi import metrics, serializer
 from djapi.error import ProjectError
-from django.http import JsonResponse
+from djapi.req.compression import compress_response
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 
-__all__ = ['json_response']
+__all__ = ['json_response', 'stream_json_response']
 
+# 成功响应的固定部分，只在导入时生成一次
+_SUCCESS_ENVELOPE = MappingProxyType({'msg': ProjectError.SUCCESS.msg, 'code': ProjectError.SUCCESS.code})
 
-def json_response(data=None, status_code: int = 200) -> JsonResponse:
+
+@metrics.timed('serialization')
+def json_response(data=None, status_code: int = 200, request=None, etag: bool = False, version=None,
+                  last_modified=None, compress: bool = False) -> HttpResponse:
     """
     将字典数据转为JSON返回
-    :param data: 需要返回的数据
+    :param data: 需要返回的数据，也可以是返回数据的函数，只在需要生成响应体时调用
+    :param status_code: req 状态码，默认 200
+    :param request: HttpRequest，提供时支持条件请求，If-None-Match或If-Modified-Since匹配时返回304
+    :param etag: 是否根据序列化后的响应体生成ETag
+    :param version: 数据的版本号，例如自增版本或更新时间，ETag由版本号生成，客户端的缓存有效时不调用data也不序列化
+    :param last_modified: 数据的最后修改时间，datetime
+    :param compress: 是否按request的Accept-Encoding压缩响应体，小于DJAPI_COMPRESS_MIN_SIZE（默认1024）字节时不压缩
+    """
+    conditional = request is not None and 200 <= status_code < 300
+    etag_value = _version_etag(version) if version is not None else None
+    timestamp = int(last_modified.timestamp()) if last_modified is not None else None
+    if conditional and (etag_value or timestamp is not None):
+        response = _not_modified(request, etag_value, timestamp)
+        if response is not None:
+            return response
+    if callable(data):
+        data = data()
+    body = serializer.dumps({**_SUCCESS_ENVELOPE, 'data': data or {}})
+    response = HttpResponse(body, content_type='application/json', status=status_code)
+    if etag and etag_value is None:
+        etag_value = quote_etag(hashlib.blake2b(body, digest_size=16).hexdigest())
+        if conditional:
+            not_modified = _not_modified(request, etag_value, timestamp)
+            if not_modified is not None:
+                return not_modified
+    _set_validators(response, etag_value, timestamp)
+    if compress and request is not None:
+        compress_response(request, response)
+    return response
+
+
+def _version_etag(version) -> str:
+    return quote_etag(hashlib.blake2b(str(version).encode(), digest_size=16).hexdigest())
+
+
+def _set_validators(response, etag_value, timestamp):
+    if etag_value:
+        response['ETag'] = etag_value
+    if timestamp is not None:
+        response['Last-Modified'] = http_date(timestamp)
+
+
+def _not_modified(request, etag_value, timestamp):
+    """
+    条件请求匹配时返回304（If-Match等前置条件不满足时为412），否则返回None
+    """
+    response = get_conditional_response(request, etag=etag_value, last_modified=timestamp)
+    if response is not None:
+        _set_validators(response, etag_value, timestamp)
+    return response
+
+
+def stream_json_response(data, status_code: int = 200, chunk_size: int = 1000, request=None,
+                         compress: bool = False) -> StreamingHttpResponse:
+    """
+    以流的方式返回列表数据，响应格式与json_response相同，data为数组，没有元素时与json_response([])一样data为{}
+    每次序列化chunk_size个元素，内存占用与列表总长度无关
+    第一批数据在返回响应前读取，查询出错时仍由ProjectExceptionMiddleware处理，之后发生的异常只能中断响应
+    :param data: 可迭代对象，例如生成器或QuerySet（需要用values()等返回可序列化的元素），
+                 QuerySet会通过iterator(chunk_size)分批从数据库读取
     :param status_code: req 状态码，默认 200
+    :param chunk_size: 每次序列化并输出的元素个数
+    :param request: HttpRequest，压缩时用于协商编码
+    :param compress: 是否按request的Accept-Encoding逐块压缩
     """
-    result = ProjectError.SUCCESS.to_dict()
-    if data:
-        result['data'] = data
-    return JsonResponse(result, json_dumps_params={'ensure_ascii': False}, status=status_code)
+    if hasattr(data, 'iterator'):
+        data = data.iterator(chunk_size=chunk_size)
+    items = iter(data)
+    first = list(islice(items, chunk_size))
+    if first:
+        content = _stream_chunks(chain([first], iter(lambda: list(islice(items, chunk_size)), [])))
+    else:
+        content = iter([serializer.dumps({**_SUCCESS_ENVELOPE, 'data': {}})])
+    response = StreamingHttpResponse(content, content_type='application/json', status=status_code)
+    if compress and request is not None:
+        compress_response(request, response)
+    return response
+
+
+def _stream_chunks(batches):
+    dumps = serializer.dumps
+    # 由当前JSON后端生成信封和分隔符，保证与json_response的输出一致
+    envelope = dumps({**_SUCCESS_ENVELOPE, 'data': []})
+    yield envelope[:-2]
+    separator = dumps([0, 0])[2:-2]
+    first = True
+    for batch in batches:
+        if not batch:
+            continue
+        chunk = dumps(batch)[1:-1]
+        if first:
+            first = False
+            yield chunk
+        else:
+            yield separator + chunk
+    yield envelope[-2:]
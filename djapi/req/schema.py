@@ -0,0 +1,323 @@
+from django.core.exceptions import TooManyFieldsSent
+from djapi import metrics
+from djapi.error import ProjectError
+from djapi.req.params import ParamType, _as_param_type
+from djapi.req.request import _get_type_name, _load_json_data, _preload_multipart
+from djapi.req.upload import _abort_streamed_files, stream_files
+
+__all__ = ['Field', 'Schema']
+
+_INVALID = object()
+
+_SOURCES = ('json', 'query', 'multipart')
+_DEFAULT_TYPES = {'json': object, 'query': None, 'multipart': bytes}
+_DEFAULT_ALLOW_EMPTY = {'json': False, 'query': True, 'multipart': False}
+_MULTIPART_TYPES = (int, str, list, float, bytes)
+
+
+class Field:
+    """
+    Schema中的字段声明，参数含义与get_json_field/get_param_value/get_multipart_field一致
+    """
+
+    def __init__(self, required_type=None, allow_empty=None, allowed_values=None, default=None,
+                 fields=None, items=None, sink=None):
+        """
+        :param required_type: 要求的数据类型，为None时使用数据来源的默认类型（json为object，multipart为bytes，query不转换）
+        :param allow_empty: 是否可以为null或者为空白，为None时使用数据来源对应getter的默认值
+        :param allowed_values: field的可取值范围，为None或者空时不限制取值
+        :param default: 如果field不存在时的默认值
+        :param fields: 嵌套对象的字段声明，{字段名: Field}，仅用于json
+        :param items: 数组元素的字段声明，Field，仅用于json
+        :param sink: 接收上传文件的FileSink或UploadRule，文件边接收边检查并交给sink，仅用于multipart
+        """
+        if fields is not None and required_type is None:
+            required_type = dict
+        if items is not None and required_type is None:
+            required_type = list
+        self.required_type = required_type
+        self.allow_empty = allow_empty
+        self.allowed_values = allowed_values
+        self.default = default
+        self.fields = fields
+        self.items = items
+        self.sink = sink
+
+
+class Schema:
+    """
+    请求数据的声明式校验，在定义时将所有字段编译为一个校验函数，一次校验整个请求，
+    所有字段的错误汇总为一个ProjectException抛出
+
+    用法::
+
+        CREATE_USER = Schema({
+            'name': Field(str),
+            'age': Field(int, allow_empty=True, default=0),
+            'tags': Field(items=Field(str)),
+        })
+
+        def view(request):
+            data = CREATE_USER.validate(request)
+
+    multipart只解析一次请求体，上传文件可以直接写入磁盘::
+
+        UPLOAD = Schema({
+            'title': Field(str),
+            'video': Field(bytes, sink=DiskFileSink('/data/uploads')),
+        }, 'multipart')
+
+        @csrf_exempt
+        def view(request):
+            data = UPLOAD.validate(request)
+            shutil.move(data['video'].path, ...)
+    """
+
+    def __init__(self, fields: dict, source: str = 'json'):
+        """
+        :param fields: {字段名: Field}
+        :param source: 数据来源，json、query或multipart
+        """
+        if source not in _SOURCES:
+            raise ValueError(f'source must be one of {", ".join(_SOURCES)}')
+        self.fields = fields
+        self.source = source
+        if source == 'json':
+            self._validator = _compile_object(fields, '')
+        elif source == 'query':
+            self._validator = _compile_flat(fields, _compile_query_field)
+        else:
+            self._validator = _compile_flat(fields, _compile_multipart_field)
+        self._sinks = {name: spec.sink for name, spec in fields.items() if spec.sink is not None}
+
+    @metrics.timed('validation', before=lambda self, request, file_sinks=None: self._preload(request, file_sinks))
+    def validate(self, request, file_sinks: dict = None) -> dict:
+        """
+        校验request中的数据，返回{字段名: 值}，若发生错误则终止响应
+        :param file_sinks: {字段名: FileSink或UploadRule}，与Field中声明的sink合并，仅用于multipart
+        """
+        if self.source == 'json':
+            return self.validate_data(_load_json_data(request))
+        if self.source == 'query':
+            return self._run(request.GET)
+        if not request.content_type.startswith('multipart/form-data'):
+            raise ProjectError.NOT_ACCEPTABLE("Content-Type must be multipart/form-data")
+        self._install_sinks(request, file_sinks)
+        try:
+            return self._run((request.POST, request.FILES))
+        except Exception as e:
+            # 解析或校验失败时调用者拿不到已经接收的文件，由sink丢弃，例如删除DiskFileSink保存的文件
+            _abort_streamed_files(request)
+            if isinstance(e, TooManyFieldsSent):
+                raise ProjectError.UNPROCESSABLE("Too many fields sent")
+            raise
+
+    def validate_data(self, data) -> dict:
+        """
+        校验已经解析好的数据，json为dict，query为QueryDict，multipart为(request.POST, request.FILES)
+        """
+        return self._run(data)
+
+    def _preload(self, request, file_sinks=None):
+        if self.source == 'json':
+            _load_json_data(request)
+        elif self.source == 'multipart':
+            self._install_sinks(request, file_sinks)
+            _preload_multipart(request)
+
+    def _install_sinks(self, request, file_sinks):
+        # 请求体已经解析过时文件已经由Django接收，不再安装
+        sinks = {**self._sinks, **file_sinks} if file_sinks else self._sinks
+        if sinks and not hasattr(request, '_files'):
+            stream_files(request, sinks)
+
+    def _run(self, data):
+        errors = []
+        result = self._validator(data, errors)
+        if errors:
+            raise _aggregate(errors)
+        return result
+
+
+def _aggregate(errors):
+    # 错误以(错误码, 字段路径, 信息模板)记录，只在出错时格式化
+    errors = [(code, path, template.format(path=path)) for code, path, template in errors]
+    if len(errors) == 1:
+        code, _, msg = errors[0]
+        return ProjectError[code](msg)
+    detail = "; ".join(msg for _, _, msg in errors)
+    data = {'errors': [{'field': path, 'code': code, 'msg': msg} for code, path, msg in errors]}
+    return ProjectError[errors[0][0]](detail, data=data)
+
+
+def _compile_flat(fields, compile_field):
+    checks = tuple((name, compile_field(name, spec)) for name, spec in fields.items())
+
+    def validate(data, errors):
+        result = {}
+        for name, check in checks:
+            result[name] = check(data, errors)
+        return result
+
+    return validate
+
+
+def _compile_object(fields, prefix):
+    checks = tuple((name, _compile_json_value(f'{prefix}{name}', spec)) for name, spec in fields.items())
+
+    def validate(data, errors):
+        result = {}
+        for name, check in checks:
+            value = check(data.get(name), errors)
+            if value is not _INVALID:
+                result[name] = value
+        return result
+
+    return validate
+
+
+def _compile_json_value(path, spec: Field):
+    required_type = spec.required_type or _DEFAULT_TYPES['json']
+    allow_empty = _DEFAULT_ALLOW_EMPTY['json'] if spec.allow_empty is None else spec.allow_empty
+    allowed_values = spec.allowed_values or None
+    default = spec.default
+    int_to_float = required_type == float
+    missing = (ProjectError.FIELD_MISSING.code, path, "Field {path} is either missing or empty")
+    wrong_type = (ProjectError.WRONG_FIELD_TYPE.code, path,
+                  'Field "{path}" should be ' + _get_type_name(required_type))
+    if allowed_values:
+        allowed_values_msg = ", ".join(map(str, allowed_values)).replace('{', '{{').replace('}', '}}')
+        invalid = (ProjectError.INVALID_FIELD_VALUE.code, path,
+                   'Value of field "{path}" should be one of [' + allowed_values_msg + ']')
+    nested = _compile_object(spec.fields, f'{path}.') if spec.fields else None
+    items = _compile_json_items(path, spec.items) if spec.items is not None else None
+
+    def check(value, errors):
+        if not allow_empty and isinstance(value, (dict, list, str)) and not value \
+                and isinstance(value, required_type):
+            value = None  # 空白值也认为是None
+        if value is None:
+            if not allow_empty:
+                errors.append(missing)
+                return _INVALID
+            return default
+        if int_to_float and isinstance(value, int):
+            value = float(value)
+        if not isinstance(value, required_type):
+            errors.append(wrong_type)
+            return _INVALID
+        if allowed_values and value not in allowed_values:
+            errors.append(invalid)
+            return _INVALID
+        if nested is not None:
+            return nested(value, errors)
+        if items is not None:
+            return items(value, errors)
+        return value
+
+    return check
+
+
+def _compile_json_items(path, spec: Field):
+    # 数组元素的路径依赖下标，只在出错时生成错误信息
+    check = _compile_json_value('', spec)
+
+    def validate(values, errors):
+        result = []
+        for i, value in enumerate(values):
+            n = len(errors)
+            result.append(check(value, errors))
+            for j in range(n, len(errors)):
+                code, item_path, template = errors[j]
+                errors[j] = (code, f'{path}[{i}]{item_path}', template)
+        return result
+
+    return validate
+
+
+def _compile_query_field(field, spec: Field):
+    required_type = spec.required_type
+    allow_empty = _DEFAULT_ALLOW_EMPTY['query'] if spec.allow_empty is None else spec.allow_empty
+    allowed_values = spec.allowed_values
+    default = spec.default
+    param_type = _as_param_type(required_type) if required_type is not None else None
+    if default is not None and required_type is not None and not isinstance(required_type, ParamType) \
+            and not isinstance(default, required_type):
+        raise TypeError(f'default of field "{field}" should be {_get_type_name(required_type)}')
+    missing = (ProjectError.FIELD_MISSING.code, field, "Field {path} is either missing of empty")
+    wrong_type = (ProjectError.WRONG_FIELD_TYPE.code, field, 'Field "{path}" must be '
+                  + _get_type_name(required_type).replace('{', '{{').replace('}', '}}'))
+    if allowed_values is not None:
+        choices = ", ".join(map(str, allowed_values)).replace('{', '{{').replace('}', '}}')
+
+    def check(query, errors):
+        if param_type is None:
+            value = query.get(field) or None
+        else:
+            try:
+                value = param_type.parse(query, field)
+            except (TypeError, ValueError):
+                errors.append(wrong_type)
+                return _INVALID
+        if value is None:
+            if allow_empty:
+                return default
+            errors.append(missing)
+            return _INVALID
+        if allowed_values is not None:
+            for item in (param_type.values(value) if param_type is not None else (value,)):
+                if item not in allowed_values:
+                    given = str(item).replace('{', '{{').replace('}', '}}')
+                    msg = f"Value of field {{path}} can only be one of [{choices}], but {given} was given."
+                    errors.append((ProjectError.INVALID_FIELD_VALUE.code, field, msg))
+                    return _INVALID
+        return value
+
+    return check
+
+
+def _compile_multipart_field(field, spec: Field):
+    required_type = spec.required_type or _DEFAULT_TYPES['multipart']
+    allow_empty = _DEFAULT_ALLOW_EMPTY['multipart'] if spec.allow_empty is None else spec.allow_empty
+    allowed_values = spec.allowed_values
+    default = spec.default
+    if required_type not in _MULTIPART_TYPES:
+        raise TypeError(f"{_get_type_name(required_type)} is not supported")
+    if required_type == list and allowed_values:
+        raise TypeError('Cannot use "allowed_values" when required_type is list')
+    missing = (ProjectError.FIELD_MISSING.code, field, 'field "{path}" is missing')
+    wrong_type = (ProjectError.WRONG_FIELD_TYPE.code, field,
+                  'Field "{path}" should be ' + _get_type_name(required_type) + '.')
+    if allowed_values is not None:
+        choices = ",".join(map(str, allowed_values)).replace('{', '{{').replace('}', '}}')
+        invalid = (ProjectError.INVALID_FIELD_VALUE.code, field,
+                   'Value of field "{path}" should be one of [' + choices + '].')
+    convert = required_type not in (list, bytes)
+
+    def check(data, errors):
+        post, files = data
+        if required_type == bytes:
+            value = files.get(field)
+        elif required_type == list:
+            value = post.getlist(field)
+            if not value and not allow_empty:
+                value = None
+        else:
+            value = post.get(field) or None
+        if value is None:
+            if allow_empty:
+                return default
+            errors.append(missing)
+            return _INVALID
+        if convert:
+            try:
+                value = required_type(value)
+            except (ValueError, TypeError):
+                errors.append(wrong_type)
+                return _INVALID
+            if allowed_values is not None and value not in allowed_values:
+                errors.append(invalid)
+                return _INVALID
+        return value
+
+    return check
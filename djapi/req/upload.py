@@ -0,0 +1,416 @@
+import abc
+import copy
+import hashlib
+import os
+import tempfile
+from functools import wraps
+
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from django.http import HttpRequest
+from djapi.error import ProjectError
+from djapi.error.middleware import iscoroutinefunction
+
+__all__ = ['StreamedFile', 'FileSink', 'DiskFileSink', 'CallbackFileSink', 'HashingFileSink', 'UploadRule',
+           'MAGIC_NUMBERS', 'StreamingUploadHandler', 'stream_files', 'stream_uploads']
+
+# 常见文件类型的文件头，(偏移, 字节)，满足其中一个即可
+MAGIC_NUMBERS = {
+    'image/png': ((0, b'\x89PNG\r\n\x1a\n'),),
+    'image/jpeg': ((0, b'\xff\xd8\xff'),),
+    'image/gif': ((0, b'GIF87a'), (0, b'GIF89a')),
+    'image/webp': ((8, b'WEBP'),),
+    'application/pdf': ((0, b'%PDF-'),),
+    'application/zip': ((0, b'PK\x03\x04'), (0, b'PK\x05\x06')),
+    'application/gzip': ((0, b'\x1f\x8b'),),
+    'video/mp4': ((4, b'ftyp'),),
+}
+
+
+class StreamedFile:
+    """
+    由FileSink接收的上传文件，在request.FILES中代替UploadedFile
+    """
+
+    def __init__(self, field_name, name, content_type, charset=None):
+        self.field_name = field_name
+        self.name = name
+        self.content_type = content_type
+        self.charset = charset
+        self.size = 0
+        # DiskFileSink保存的文件路径
+        self.path = None
+        # CallbackFileSink的on_complete返回值
+        self.result = None
+        # HashingFileSink计算的十六进制摘要
+        self.digest = None
+        self._handle = None
+        # 接收文件的FileSink
+        self._sink = None
+
+    def open(self, mode='rb'):
+        """
+        打开DiskFileSink保存的文件
+        """
+        if self.path is None:
+            raise ValueError(f'File of field "{self.field_name}" was not saved to disk')
+        return open(self.path, mode)
+
+    def close(self):
+        # HttpRequest.close()会关闭request.FILES中的所有文件
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def abort(self):
+        """
+        丢弃已经接收的文件，例如删除DiskFileSink保存的文件
+        """
+        if self._sink is not None:
+            self._sink.abort(self)
+            self._sink = None
+
+    def __repr__(self):
+        return f'<StreamedFile: {self.name} ({self.content_type}, {self.size} bytes)>'
+
+
+class FileSink(abc.ABC):
+    """
+    接收上传文件的数据块，数据块到达时立即处理，不在内存或临时文件中保留完整文件
+    同一个sink会被多个请求同时使用，每个文件的状态保存在StreamedFile上，子类必须实现write
+    """
+
+    def open(self, file: StreamedFile):
+        pass
+
+    @abc.abstractmethod
+    def write(self, file: StreamedFile, chunk: bytes):
+        pass
+
+    def close(self, file: StreamedFile):
+        """
+        文件接收完毕
+        """
+        pass
+
+    def abort(self, file: StreamedFile):
+        """
+        上传中断，文件不完整
+        """
+        pass
+
+
+class DiskFileSink(FileSink):
+    """
+    将文件直接写入directory，由调用者负责移动或删除StreamedFile.path，请求体解析失败或者Schema.validate校验失败时自动删除
+    """
+
+    def __init__(self, directory=None, prefix='djapi-upload-'):
+        """
+        :param directory: 保存文件的目录，默认为系统临时目录
+        :param prefix: 文件名前缀
+        """
+        self.directory = directory
+        self.prefix = prefix
+
+    def open(self, file):
+        fd, file.path = tempfile.mkstemp(prefix=self.prefix, dir=self.directory)
+        file._handle = os.fdopen(fd, 'wb')
+
+    def write(self, file, chunk):
+        file._handle.write(chunk)
+
+    def close(self, file):
+        file.close()
+
+    def abort(self, file):
+        file.close()
+        if file.path is not None:
+            os.unlink(file.path)
+            file.path = None
+
+
+class CallbackFileSink(FileSink):
+    """
+    将数据块交给回调函数，例如上传到对象存储
+    """
+
+    def __init__(self, on_chunk, on_complete=None):
+        """
+        :param on_chunk: on_chunk(file, chunk)
+        :param on_complete: on_complete(file)，返回值保存在StreamedFile.result
+        """
+        self._on_chunk = on_chunk
+        self._on_complete = on_complete
+
+    def write(self, file, chunk):
+        self._on_chunk(file, chunk)
+
+    def close(self, file):
+        if self._on_complete is not None:
+            file.result = self._on_complete(file)
+
+
+class HashingFileSink(FileSink):
+    """
+    计算文件摘要，保存在StreamedFile.digest，数据块可以继续交给另一个sink保存
+    """
+
+    def __init__(self, algorithm: str = 'sha256', sink: FileSink = None):
+        """
+        :param algorithm: hashlib支持的算法名
+        :param sink: 同时接收数据块的sink，为None时只计算摘要，不保存文件
+        """
+        hashlib.new(algorithm)
+        self.algorithm = algorithm
+        self.sink = sink
+
+    def open(self, file):
+        file._hash = hashlib.new(self.algorithm)
+        if self.sink is not None:
+            self.sink.open(file)
+
+    def write(self, file, chunk):
+        file._hash.update(chunk)
+        if self.sink is not None:
+            self.sink.write(file, chunk)
+
+    def close(self, file):
+        file.digest = file._hash.hexdigest()
+        if self.sink is not None:
+            self.sink.close(file)
+
+    def abort(self, file):
+        if self.sink is not None:
+            self.sink.abort(file)
+
+
+class UploadRule:
+    """
+    上传文件字段的限制，在数据块到达时检查，不满足时立即以ProjectError.UNPROCESSABLE终止上传
+    """
+
+    def __init__(self, max_size: int = None, content_types=None, magic=None, sink: FileSink = None):
+        """
+        :param max_size: 文件的最大字节数
+        :param content_types: 允许的Content-Type，可以使用image/*这样的通配
+        :param magic: 文件头，bytes或(偏移, bytes)的列表，满足其中一个即可；
+                      为True时根据content_types从MAGIC_NUMBERS中查找
+        :param sink: 接收文件的FileSink，为None时文件仍由Django默认的upload handler保存
+        """
+        self.max_size = max_size
+        self.content_types = tuple(content_types) if content_types else None
+        if magic is True:
+            if not self.content_types:
+                raise ValueError('"magic=True" requires content_types')
+            magic = [x for content_type, signatures in MAGIC_NUMBERS.items()
+                     if self.allows_content_type(content_type) for x in signatures]
+            if not magic:
+                raise ValueError(f'No magic numbers known for {", ".join(self.content_types)}')
+        self.signatures = tuple(x if isinstance(x, tuple) else (0, x) for x in magic) if magic else ()
+        self.sink = sink
+
+    def allows_content_type(self, content_type: str) -> bool:
+        if self.content_types is None:
+            return True
+        return any(allowed == content_type or allowed.endswith('/*') and content_type.startswith(allowed[:-1])
+                   for allowed in self.content_types)
+
+    def sniff(self, head: bytes):
+        """
+        :return: 文件头匹配时为True，不匹配时为False，数据不够判断时为None
+        """
+        undecided = False
+        for offset, signature in self.signatures:
+            if len(head) >= offset + len(signature):
+                if head[offset:offset + len(signature)] == signature:
+                    return True
+            else:
+                undecided = True
+        return None if undecided else False
+
+
+def _as_rule(rule) -> UploadRule:
+    return rule if isinstance(rule, UploadRule) else UploadRule(sink=rule)
+
+
+class StreamingUploadHandler(FileUploadHandler):
+    """
+    按UploadRule检查指定字段的上传文件，并将文件交给对应的FileSink，
+    没有sink的字段和其它字段仍由Django默认的upload handler保存
+    """
+
+    def __init__(self, request=None, rules: dict = None):
+        """
+        :param rules: {字段名: UploadRule或FileSink}
+        """
+        super().__init__(request)
+        self.rules = {}
+        self.update(rules or {})
+        self._rule = None
+        self._file = None
+        self._size = 0
+        self._head = None
+        self._completed = []
+
+    def update(self, rules: dict):
+        """
+        合并字段的限制，后提供的非空设置覆盖之前的设置
+        """
+        for field, rule in rules.items():
+            rule = _as_rule(rule)
+            current = self.rules.get(field)
+            if current is not None:
+                merged = copy.copy(current)
+                for name in ('max_size', 'content_types', 'signatures', 'sink'):
+                    if getattr(rule, name):
+                        setattr(merged, name, getattr(rule, name))
+                rule = merged
+            self.rules[field] = rule
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        rule = self._rule = self.rules.get(field_name)
+        self._file = None
+        if rule is None:
+            return
+        self._size = 0
+        self._head = b'' if rule.signatures else None
+        if not rule.allows_content_type(content_type):
+            self._reject(f'Content-Type of file "{field_name}" should be one of [{", ".join(rule.content_types)}]')
+        if rule.max_size is not None and content_length is not None and content_length > rule.max_size:
+            self._reject_size()
+        if rule.sink is not None:
+            self._file = StreamedFile(field_name, file_name, content_type, charset)
+            self._file._sink = rule.sink
+            rule.sink.open(self._file)
+            raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        rule = self._rule
+        if rule is None:
+            return raw_data
+        self._size += len(raw_data)
+        if rule.max_size is not None and self._size > rule.max_size:
+            self._reject_size()
+        if self._head is not None:
+            # 文件头检查通过之前数据块不交给sink或后续的upload handler
+            self._head += raw_data
+            matched = rule.sniff(self._head)
+            if matched is None:
+                return None
+            if not matched:
+                self._reject_magic()
+            raw_data, self._head = self._head, None
+        if self._file is None:
+            return raw_data
+        rule.sink.write(self._file, raw_data)
+        self._file.size += len(raw_data)
+
+    def file_complete(self, file_size):
+        if self._rule is not None and self._head is not None:
+            # 文件比需要检查的文件头还短
+            self._reject_magic()
+        file = self._file
+        self._rule = None
+        if file is None:
+            return None
+        self._file = None
+        self._completed.append(file)
+        file._sink.close(file)
+        return file
+
+    def upload_interrupted(self):
+        if self._file is not None:
+            self._file.abort()
+            self._file = None
+
+    def _reject_size(self):
+        self._reject(f'File "{self.field_name}" should not be larger than {self._rule.max_size} bytes')
+
+    def _reject_magic(self):
+        self._reject(f'Content of file "{self.field_name}" does not match its type')
+
+    def abort(self):
+        """
+        丢弃正在接收和已经接收的文件
+        """
+        self.upload_interrupted()
+        for file in self._completed:
+            file.abort()
+        self._completed.clear()
+
+    def _reject(self, msg):
+        # 丢弃已经接收的文件，之后访问request.POST和request.FILES得到空值，不再读取剩余的请求体
+        self.abort()
+        if self.request is not None:
+            self.request._mark_post_parse_error()
+        raise ProjectError.UNPROCESSABLE(msg)
+
+
+def stream_files(request: HttpRequest, rules: dict):
+    """
+    让request中指定字段的上传文件边接收边检查，并交给FileSink，必须在访问request.POST或request.FILES之前调用，
+    视图需要用csrf_exempt避免CsrfViewMiddleware提前解析请求体
+    接收完毕后有sink的字段在request.FILES中为StreamedFile
+
+    :param request: HttpRequest
+    :param rules: {字段名: UploadRule或FileSink}
+    """
+    if hasattr(request, '_files'):
+        raise RuntimeError("stream_files() must be called before request.POST or request.FILES is accessed")
+    for handler in request.upload_handlers:
+        if isinstance(handler, StreamingUploadHandler):
+            handler.update(rules)
+            return
+    request.upload_handlers.insert(0, StreamingUploadHandler(request, rules))
+
+
+def _abort_streamed_files(request: HttpRequest):
+    """
+    丢弃由FileSink接收的文件，用于请求体解析失败或者其它字段校验失败时
+    解析失败时Django会清空request.FILES，因此通过upload handler找到这些文件
+    """
+    for handler in request.upload_handlers:
+        if isinstance(handler, StreamingUploadHandler):
+            handler.abort()
+
+
+def _parse_multipart(request: HttpRequest):
+    """
+    解析multipart请求体，TooManyFieldsSent、RequestDataTooBig等解析错误原样抛出，抛出前丢弃由FileSink接收的文件
+    """
+    try:
+        request.POST, request.FILES
+    except Exception:
+        _abort_streamed_files(request)
+        raise
+
+
+def stream_uploads(rules: dict):
+    """
+    按视图配置上传文件的限制，同时支持同步和异步视图::
+
+        @csrf_exempt
+        @stream_uploads({'avatar': UploadRule(max_size=2 * 1024 * 1024, content_types=['image/png'], magic=True)})
+        def view(request):
+            avatar = get_multipart_field(request, 'avatar')
+
+    :param rules: {字段名: UploadRule或FileSink}
+    """
+    def decorator(func):
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_inner(request, *args, **kwargs):
+                stream_files(request, rules)
+                return await func(request, *args, **kwargs)
+
+            return async_inner
+
+        @wraps(func)
+        def inner(request, *args, **kwargs):
+            stream_files(request, rules)
+            return func(request, *args, **kwargs)
+
+        return inner
+
+    return decorator
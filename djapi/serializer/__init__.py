@@ -0,0 +1,132 @@
+import json
+import math
+from django.core.serializers.json import DjangoJSONEncoder
+from djapi.env import get_var
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+__all__ = ['JSONBackend', 'loads', 'dumps', 'get_backend', 'set_backend']
+
+
+class JSONBackend:
+    """
+    JSON序列化后端，dumps返回utf-8编码的bytes，非ASCII字符原样输出（与ensure_ascii=False一致），
+    loads解析失败时抛出ValueError（json.JSONDecodeError是它的子类）
+    """
+
+    def __init__(self, name: str, loads, dumps):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+    def __repr__(self):
+        return f'<JSONBackend: {self.name}>'
+
+
+# datetime、Decimal、UUID、lazy字符串等与Django的JsonResponse保持一致的输出
+_default = DjangoJSONEncoder().default
+_encode = DjangoJSONEncoder(ensure_ascii=False).encode
+
+
+def _json_dumps(obj) -> bytes:
+    return _encode(obj).encode('utf-8')
+
+
+def _has_non_finite(obj) -> bool:
+    """
+    obj中是否有NaN、Infinity，orjson会把它们输出为null
+    """
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(_has_non_finite(x) for x in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(_has_non_finite(x) for x in obj)
+    return False
+
+
+def _json_backend():
+    return JSONBackend('json', json.loads, _json_dumps)
+
+
+def _orjson_backend():
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    orjson_dumps = orjson.dumps
+    encode_error = orjson.JSONEncodeError
+
+    def dumps(obj):
+        # 超过64位的整数orjson会报错、NaN和Infinity会变成null，这两种情况使用标准库json，输出与json后端一致
+        try:
+            body = orjson_dumps(obj, default=_default, option=option)
+        except encode_error:
+            return _json_dumps(obj)
+        if b'null' in body and _has_non_finite(obj):
+            return _json_dumps(obj)
+        return body
+
+    return JSONBackend('orjson', orjson.loads, dumps)
+
+
+def _ujson_backend():
+    ujson_dumps = ujson.dumps
+
+    def dumps(obj):
+        # 超过64位的整数（部分版本还包括NaN）ujson会抛出OverflowError，使用标准库json
+        try:
+            body = ujson_dumps(obj, ensure_ascii=False, escape_forward_slashes=False, default=_default)
+        except OverflowError:
+            return _json_dumps(obj)
+        return body.encode('utf-8')
+
+    return JSONBackend('ujson', ujson.loads, dumps)
+
+
+_factories = {'json': _json_backend}
+if orjson is not None:
+    _factories['orjson'] = _orjson_backend
+if ujson is not None:
+    _factories['ujson'] = _ujson_backend
+
+_backend = None
+
+
+def set_backend(name: str = 'auto') -> JSONBackend:
+    """
+    切换JSON后端
+    :param name: orjson、ujson、json或auto，auto时按orjson、ujson、json的顺序选择已安装的第一个
+    """
+    global _backend
+    if name == 'auto':
+        name = next(x for x in ('orjson', 'ujson', 'json') if x in _factories)
+    if name not in _factories:
+        raise ValueError(f'JSON backend "{name}" is not available')
+    _backend = _factories[name]()
+    return _backend
+
+
+def get_backend() -> JSONBackend:
+    """
+    当前使用的JSON后端，首次调用时由环境变量DJAPI_JSON_BACKEND决定，默认为auto
+    """
+    return _backend or set_backend(get_var('DJAPI_JSON_BACKEND', default='auto'))
+
+
+def loads(s):
+    """
+    解析JSON字符串或bytes
+    """
+    return (_backend or get_backend()).loads(s)
+
+
+def dumps(obj) -> bytes:
+    """
+    将对象序列化为utf-8编码的JSON bytes
+    """
+    return (_backend or get_backend()).dumps(obj)
@@ -51,5 +51,5 @@ class TestFunctional(LiveServerTestCase):
         j = JSONRequester()
         url = f"{self.live_server_url}{view}"
         data = {'a': 'afsdfsdfsdf'}
-        j.post(url, json=data)
-        self.assertTrue(j.data, data)
+        result = j.post(url, json=data)
+        self.assertEqual(result.data['a'], data['a'])
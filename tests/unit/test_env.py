@@ -1,4 +1,7 @@
 from django.test import TestCase
+import os
+
+from djapi import env
 from djapi.env import get_var
 
 
@@ -12,3 +15,36 @@ class TestEnv(TestCase):
         self.assertEqual(b, True)
         self.assertEqual(c, 'asdfasdf')
         self.assertEqual(d, 100)
+
+    def test_typed_env(self):
+        os.environ.update(DJAPI_TEST_INT='12', DJAPI_TEST_BOOL='Yes', DJAPI_TEST_LIST='a, b,,c',
+                          DJAPI_TEST_LIST_LITERAL='[1, 2]', DJAPI_TEST_DURATION='1.5m', DJAPI_TEST_BAD='abc')
+        env.reload()
+        self.assertEqual(env.get_int('DJAPI_TEST_INT'), 12)
+        self.assertEqual(env.get_float('DJAPI_TEST_INT'), 12.0)
+        self.assertEqual(env.get_str('DJAPI_TEST_INT'), '12')
+        self.assertTrue(env.get_bool('DJAPI_TEST_BOOL'))
+        self.assertEqual([env._parse_bool(x) for x in ('2', '0', 'None', '[1]', 'Off')],
+                         [True, False, False, True, False])
+        self.assertFalse(env.get_bool('DJAPI_TEST_MISSING', default=False))
+        self.assertEqual(env.get_list('DJAPI_TEST_LIST'), ['a', 'b', 'c'])
+        self.assertEqual(env.get_list('DJAPI_TEST_LIST_LITERAL'), [1, 2])
+        self.assertEqual(env.get_duration('DJAPI_TEST_DURATION'), 90)
+        self.assertRaises(ValueError, env.get_int, 'DJAPI_TEST_BAD')
+        self.assertRaises(ValueError, env.get_int, 'DJAPI_TEST_MISSING')
+
+        # 解析结果被缓存，直到reload()
+        os.environ['DJAPI_TEST_INT'] = '13'
+        self.assertEqual(env.get_int('DJAPI_TEST_INT'), 12)
+        env.reload()
+        self.assertEqual(env.get_int('DJAPI_TEST_INT'), 13)
+
+        timeout = env.declare('DJAPI_TEST_DURATION', env.get_duration)
+        env.declare('DJAPI_TEST_BAD', env.get_bool)
+        env.declare('DJAPI_TEST_MISSING', env.get_int)
+        self.assertEqual(timeout(), 90)
+        with self.assertRaises(ValueError) as cm:
+            env.validate()
+        self.assertIn('DJAPI_TEST_BAD', str(cm.exception))
+        self.assertIn('DJAPI_TEST_MISSING', str(cm.exception))
+        env._declared.clear()
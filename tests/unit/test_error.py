@@ -1,11 +1,18 @@
 import json
 
 import os
+from unittest.mock import patch
 
-from djapi.error.error_code import ProjectError, ProjectException
+from djapi import env, serializer
+
+from djapi.error.error_code import ProjectError, ProjectErrorMetaClass, ProjectException, e
 from djapi.error.error_handler import ModelExceptionHandler
 from djapi.error.middleware import ProjectExceptionMiddleware
-from django.test import TestCase, RequestFactory
+from djapi.error.log_policy import ErrorLogPolicy
+import threading
+
+from django.shortcuts import reverse
+from django.test import TestCase, RequestFactory, AsyncClient
 from tests.models import ModelForTesting
 from djapi.test.testcase import assert_error
 
@@ -21,13 +28,44 @@ class TestError(TestCase):
         e = ProjectError.REMOTE_SERVER_ERROR
         self.assertTrue(e.code, ProjectError[e.code].code)
 
+    def test_error_members(self):
+        a, b = ProjectError.NOT_FOUND, ProjectError.NOT_FOUND
+        self.assertIsNot(a, b)
+        self.assertEqual((a.msg, a.code, a.status_code), ("Resource not found", 404, 404))
+        a("detail")
+        self.assertIsNone(b.error_detail)
+        self.assertIsNone(ProjectError.NOT_FOUND.error_detail)
+        self.assertEqual(ProjectError[404].code, 404)
+        self.assertRaises(KeyError, lambda: ProjectError[123456])
+        with self.assertRaises(ValueError):
+            ProjectError.NOT_FOUND = 1
+
+        # 错误码注册在全局，测试结束后移除，避免影响同一进程中的其它测试
+        self.addCleanup(ProjectErrorMetaClass._error_code_dict.pop, 9001, None)
+
+        class SubError(ProjectError):
+            SUB_ERROR = e("Sub error", 9001)
+
+        self.assertEqual(SubError.SUB_ERROR.code, 9001)
+        self.assertEqual(SubError.NOT_FOUND.code, 404)
+        self.assertEqual(ProjectError[9001].msg, "Sub error")
+
     def test_middleware(self):
         request = RequestFactory()
         middleware = ProjectExceptionMiddleware(lambda x: x)
         os.environ['RE_RAISE_UNKNOWN_EXCEPTIONS'] = "True"
+        env.reload()
+        self.assertRaises(ValueError, middleware.process_exception,
+                          request, ValueError)
+        os.environ['RE_RAISE_UNKNOWN_EXCEPTIONS'] = "2"
+        env.reload()
         self.assertRaises(ValueError, middleware.process_exception,
                           request, ValueError)
+        os.environ['RE_RAISE_UNKNOWN_EXCEPTIONS'] = "abc"
+        env.reload()
+        self.assertRaises(ValueError, ProjectExceptionMiddleware, lambda x: x)
         os.environ['RE_RAISE_UNKNOWN_EXCEPTIONS'] = "False"
+        env.reload()
         error = ProjectError.UNKNOWN_ERROR
         res = middleware.process_exception(request,
                                            ProjectError.UNKNOWN_ERROR("Test Error", data={"files": ['1', '2 ']}))
@@ -38,6 +76,73 @@ class TestError(TestCase):
         self.assertTrue(res['data'], {"files": ['1', '2 ']})
         # TODO 检查日志
 
+    def test_middleware_logging(self):
+        request = RequestFactory().get('/path/')
+        middleware = ProjectExceptionMiddleware(lambda x: middleware.process_exception(x, ProjectError.NOT_FOUND))
+        with self.assertLogs('django', 'INFO') as cm:
+            middleware(request)
+        record = cm.records[0]
+        self.assertEqual((record.code, record.path), (404, '/path/'))
+        self.assertGreaterEqual(record.latency, 0)
+        self.assertIsNone(record.exc_info)
+
+        middleware.log_policy = ErrorLogPolicy(capture_stack=True, sample_rates={403: 0}, rate_limit=2)
+        with self.assertLogs('django', 'INFO') as cm, patch('djapi.error.log_policy.time.monotonic', return_value=1.0):
+            for _ in range(5):
+                middleware.process_exception(request, ProjectError.NOT_FOUND)
+                middleware.process_exception(request, ProjectError.PERMISSION_DENIED)
+        self.assertEqual([x.code for x in cm.records], [404, 404])
+        self.assertIsNotNone(cm.records[0].exc_info)
+
+    def test_middleware_error_body_cache(self):
+        request = RequestFactory().get('/')
+        middleware = ProjectExceptionMiddleware(lambda x: x)
+        middleware.log_policy = ErrorLogPolicy(sample_rates={403: 0, 404: 0, 500: 0})
+        middleware.error_bodies.maxsize = 2
+        exceptions = [
+            ProjectError.PERMISSION_DENIED, ProjectError.NOT_FOUND("详细信息"), ProjectError.NOT_FOUND("a"),
+            ProjectError.NOT_FOUND("b"), ProjectError.UNKNOWN_ERROR("c", data={'files': ['1']}),
+            ProjectError.NOT_FOUND({'field': 'a'}), ProjectError.NOT_FOUND(1), ProjectError.NOT_FOUND(True),
+            ProjectError.NOT_FOUND(1.0),
+        ]
+        for exception in exceptions * 2:
+            res = middleware.process_exception(request, exception)
+            self.assertEqual(res.content, serializer.dumps(exception.to_dict()))
+            self.assertEqual(res.status_code, exception.status_code)
+        self.assertIs(middleware.error_bodies.get(ProjectError.PERMISSION_DENIED),
+                      middleware.error_bodies.get(ProjectError.PERMISSION_DENIED))
+        self.assertEqual(len(middleware.error_bodies._detail), 2)
+
+    async def test_async_middleware(self):
+        client = AsyncClient()
+        view = reverse('async')
+        res = await client.get(view)
+        self.assertEqual(res.json()['code'], 0)
+        res = await client.get(view, {'error': 'project'})
+        self.assertEqual((res.status_code, res.json()['code']), (400, ProjectError.BAD_REQUEST.code))
+        self.assertEqual(res.json()['error_detail'], 'async')
+        res = await client.post(view)
+        self.assertEqual(res.json()['code'], ProjectError.METHOD_NOT_ALLOWED.code)
+        with self.assertLogs('django', 'ERROR'):
+            res = await client.get(view, {'error': 'unknown'})
+        self.assertEqual((res.status_code, res.json()['code']), (500, ProjectError.UNKNOWN_ERROR.code))
+        # 异常在事件循环中处理，没有切换到线程池
+        threads = []
+        process_exception = ProjectExceptionMiddleware.process_exception
+
+        def record_thread(*args):
+            threads.append(threading.get_ident())
+            return process_exception(*args)
+
+        with patch.object(ProjectExceptionMiddleware, 'process_exception', autospec=True, side_effect=record_thread):
+            await client.get(view, {'error': 'project'})
+        self.assertEqual(threads, [threading.get_ident()])
+
+    async def test_async_model_exception_handler(self):
+        with assert_error(ProjectError.NOT_FOUND, "hello"):
+            async with ModelExceptionHandler("hello"):
+                await ModelForTesting.objects.aget(b=-1)
+
     def test_model_exception_handler(self):
         handler = ModelExceptionHandler("hello")
         new = ModelForTesting(a='abc', b=1)
@@ -0,0 +1,51 @@
+from django.shortcuts import reverse
+from django.test import TestCase, RequestFactory
+from djapi import metrics
+from djapi.error import ProjectError
+from djapi.test import assert_error
+
+
+class TestMetrics(TestCase):
+    def tearDown(self) -> None:
+        metrics.disable()
+
+    def test_in_memory_sink(self):
+        sink = metrics.enable()
+        self.client.post(reverse('json'), {'a': 1, 'b': 'abc'}, content_type='application/json')
+        self.client.post(reverse('json'), {}, content_type='application/json')
+        self.client.get(reverse('param'), {'a': 2})
+        snapshot = sink.snapshot()
+        stages = {key: value['count'] for key, value in snapshot['histograms'].items()}
+        self.assertEqual(stages[('json', 'parse')], 2)
+        self.assertEqual(stages[('json', 'validation')], 2)
+        self.assertEqual(stages[('json', 'serialization')], 1)
+        self.assertEqual(stages[('json', 'total')], 2)
+        self.assertEqual(stages[('param', 'validation')], 1)
+        self.assertNotIn(('param', 'parse'), stages)
+        self.assertEqual(snapshot['errors'], {('json', ProjectError.FIELD_MISSING.code): 1})
+
+        text = metrics.prometheus_view(RequestFactory().get('/')).content.decode()
+        self.assertIn('djapi_stage_seconds_count{view="json",stage="parse"} 2', text)
+        self.assertIn('djapi_stage_seconds_bucket{view="json",stage="total",le="+Inf"} 2', text)
+        self.assertIn(f'djapi_errors_total{{view="json",code="{ProjectError.FIELD_MISSING.code}"}} 1', text)
+
+    def test_callback_sink(self):
+        observed, errors = [], []
+        metrics.enable(metrics.CallbackSink(lambda *args: observed.append(args), lambda *args: errors.append(args)))
+        self.client.get(reverse('other'), {'project_exception': True})
+        self.assertIn(('other', 'total'), [x[:2] for x in observed])
+        self.assertEqual(errors, [('other', ProjectError.BAD_REQUEST.code)])
+
+    def test_abstract_sink(self):
+        class IncompleteSink(metrics.MetricsSink):
+            def observe(self, view, stage, seconds):
+                pass
+
+        with self.assertRaises(TypeError):
+            IncompleteSink()
+
+    def test_disabled(self):
+        self.assertIsNone(metrics.get_sink())
+        self.client.get(reverse('param'), {'a': 2})
+        with assert_error(ProjectError.NOT_FOUND):
+            metrics.prometheus_view(RequestFactory().get('/'))
@@ -1,10 +1,40 @@
+import asyncio
+import base64
+import datetime
+import enum
+import gzip
+import hashlib
+import json
 import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import time
+import requests
+from django.conf import settings
 from django.test import LiveServerTestCase
 from djapi.test import assert_error, patch_json
+from djapi import metrics, serializer
 from djapi.error import ProjectError
-from djapi.req import param_field_getter, json_field_getter, multipart_getter, JSONRequester
+from djapi.req import param_field_getter, json_field_getter, multipart_getter, get_multipart_field, JSONRequester
+from djapi.req import Schema, Field
+from djapi.req import CircuitBreaker, Bulkhead, LazyJSONObject, FileSink
+from djapi.req.lazy_json import simdjson
+from djapi.req.json_stream import _StreamReader
+from djapi.req.async_remote import httpx
+from djapi.req import AsyncJSONRequester, json_response, stream_json_response, iter_json_array
+from djapi.req import keyset_paginate, keyset_response, cache_response, invalidate_tags, negotiate_encoding
+from djapi.req import batch_dispatcher
+from django.core.cache import caches
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from djapi.req import ListParam, RangeParam, DateTimeParam, EnumParam, Pagination, get_pagination
+from djapi.req import DiskFileSink, CallbackFileSink, StreamedFile, HashingFileSink, UploadRule, stream_uploads
+from django.core.files.uploadedfile import SimpleUploadedFile
+from tests import views
+from tests.models import ModelForTesting
 from django.test.client import RequestFactory
 from django.shortcuts import reverse
+from unittest import skipUnless
 from unittest.mock import patch, MagicMock
 
 
@@ -54,6 +84,116 @@ class HTTPRequestTest(LiveServerTestCase):
         self.assertEqual(getter('h'), {'a': 1})
         self.assertEqual(getter('d', allow_empty=True, default=100), 100)
 
+    def test_json_body_parsed_once(self):
+        body = {f'f{i}': i for i in range(40)}
+        request = self.factory.post('', body, content_type='application/json')
+        getter = json_field_getter(request)
+        with patch('djapi.serializer.loads', wraps=serializer.loads) as loads:
+            for i in range(40):
+                self.assertEqual(getter(f'f{i}', int, allow_empty=True), i)
+            self.assertEqual(loads.call_count, 1)
+            # 请求体被替换后重新解析
+            request._body = b'{"f0": 100}'
+            self.assertEqual(getter('f0', int), 100)
+            self.assertEqual(loads.call_count, 2)
+
+    def test_lazy_json_field(self):
+        body = {'a': 0, 'b': 'b', 'c': '', 'd': None, 'e': [], 'f': [1, {'x': ']'}], 'g': {}, 'h': {'a': [1, 2]}}
+        request = self.factory.post('', body, content_type='application/json')
+        getter = json_field_getter(request, lazy=True)
+        with patch('djapi.serializer.loads', wraps=serializer.loads) as loads:
+            self.assertEqual(getter('a', int, allowed_values=(0,)), 0)
+            self.assertEqual(getter('f', list), [1, {'x': ']'}])
+            self.assertEqual(getter('h', dict), {'a': [1, 2]})
+            json_data = request.__dict__['__project_json_data__'][1]
+            if simdjson is not None:
+                self.assertIsInstance(json_data, LazyJSONObject)
+                self.assertEqual(loads.call_count, 0)
+        with assert_error(ProjectError.FIELD_MISSING, "c"):
+            getter('c')
+        with assert_error(ProjectError.FIELD_MISSING, "g"):
+            getter('g')
+        with assert_error(ProjectError.WRONG_FIELD_TYPE, "str"):
+            getter('h', str)
+        with assert_error(ProjectError.INVALID_FIELD_VALUE, '1, 2'):
+            getter('a', allowed_values=(1, 2))
+        self.assertEqual(getter('d', allow_empty=True, default=1), 1)
+        self.assertEqual(getter('missing', allow_empty=True), None)
+        # 需要完整数据时转换全部字段
+        self.assertEqual(Schema({'h': Field(fields={'a': Field(items=Field(int))})}).validate(request),
+                         {'h': {'a': [1, 2]}})
+        self.assertEqual(request.__dict__['__project_json_data__'][1], body)
+
+        for invalid, msg in ((b'[1, 2]', 'json object'), (b'{"a": 1', 'Invalid'), (b'{"a": tru}', 'Invalid')):
+            request = self.factory.post('', invalid, content_type='application/json')
+            with assert_error(ProjectError.NOT_ACCEPTABLE, msg):
+                json_field_getter(request, lazy=True)('a')
+        # simdjson不支持超过64位的整数，与lazy=False一样完整解析
+        request = self.factory.post('', b'{"a": 123456789012345678901234567890}', content_type='application/json')
+        self.assertEqual(json_field_getter(request, lazy=True)('a'), serializer.loads(request.body)['a'])
+        # 字段名重复时与json.loads一样取最后一个，两种getter的结果相同
+        body = b'{"a": 1, "b": {"x": 1, "x": 2}, "a": 2}'
+        for lazy in (True, False, True):
+            request = self.factory.post('', body, content_type='application/json')
+            getter = json_field_getter(request, lazy=lazy)
+            self.assertEqual((getter('a'), getter('b')), (2, {'x': 2}))
+            self.assertEqual(json_field_getter(request, lazy=not lazy)('a'), 2)
+
+    def test_iter_json_array(self):
+        items = [{'id': i, 'name': f'名称{i}', 'score': i / 3} for i in range(3000)]
+        body = {'source': 'import', 'items': items, 'count': 12345678901234}
+        for read_body in (False, True):
+            request = self.factory.post('', body, content_type='application/json')
+            if read_body:
+                self.assertTrue(request.body)
+            self.assertEqual(list(iter_json_array(request, 'items', dict, chunk_size=7)), items)
+            getter = json_field_getter(request)
+            self.assertEqual(getter('source', str), 'import')
+            self.assertEqual(getter('count', int), 12345678901234)
+
+        request = self.factory.post('', {'items': [1, 2.5, 3]}, content_type='application/json')
+        self.assertEqual(list(iter_json_array(request, 'items', float, chunk_size=2)), [1.0, 2.5, 3.0])
+        request = self.factory.post('', {'items': [1, 'a']}, content_type='application/json')
+        with assert_error(ProjectError.WRONG_FIELD_TYPE, ['Item 1', 'integer']):
+            list(iter_json_array(request, 'items', int))
+        request = self.factory.post('', {'items': [{'a': 1}, {'a': 'b'}]}, content_type='application/json')
+        with assert_error(ProjectError.WRONG_FIELD_TYPE, 'items[1].a'):
+            list(iter_json_array(request, 'items', Field(fields={'a': Field(int)})))
+        request = self.factory.post('', '{"items": [1, 2, {"a": }]}', content_type='application/json')
+        with assert_error(ProjectError.NOT_ACCEPTABLE, 'item 2'):
+            list(iter_json_array(request, 'items', int))
+        request = self.factory.post('', {'other': 1}, content_type='application/json')
+        with assert_error(ProjectError.FIELD_MISSING, 'items'):
+            list(iter_json_array(request, 'items'))
+        # 值在块的任意位置被截断时都能解析
+        items = [True, False, None, -12.5e3, float('-inf'), 'a\u00e9\\"中', {'k': [float('inf')]}, 7]
+        body = json.dumps({'items': items}).encode()
+        for chunk_size in range(1, 12):
+            request = self.factory.post('', body, content_type='application/json')
+            self.assertEqual(list(iter_json_array(request, 'items', chunk_size=chunk_size)), items)
+
+        # 错误的元素立即报错，未结束的值不超过max_value_size，缓冲区的大小与请求体大小无关
+        fill = _StreamReader.fill
+        sizes = []
+
+        def record_fill(reader):
+            more = fill(reader)
+            sizes.append(len(reader.buf))
+            return more
+
+        rest = b', [1, 2, 3]' * 100000 + b']}'
+        with patch.object(_StreamReader, 'fill', record_fill):
+            for item, error, msg in ((b'x', ProjectError.NOT_ACCEPTABLE, 'item 1'),
+                                     (b'{"a": 1 "b"}', ProjectError.NOT_ACCEPTABLE, 'item 1'),
+                                     (b'"' + b'a' * 100000, ProjectError.UNPROCESSABLE, '10000 bytes')):
+                sizes.clear()
+                request = self.factory.post('', b'{"items": [1, ' + item + rest, content_type='application/json')
+                with assert_error(error, msg):
+                    list(iter_json_array(request, 'items', chunk_size=1024, max_value_size=10000))
+                self.assertLess(max(sizes), 10000 + 2048)
+        with assert_error(ProjectError.NOT_ACCEPTABLE):
+            iter_json_array(self.factory.get(''), 'items')
+
     def test_get_param(self):
         request = self.factory.get('', {'a': 0, 'b': "abc", 'c': '', 'd': 'true'})
         getter = param_field_getter(request)
@@ -77,6 +217,45 @@ class HTTPRequestTest(LiveServerTestCase):
         self.assertEqual(getter('b', required_type=bool), False)
         self.assertEqual(getter('b', required_type=str), "abc")
 
+    def test_typed_params(self):
+        class Color(enum.Enum):
+            RED = 'red'
+            BLUE = 'blue'
+
+        request = self.factory.get('', {'ids': ['1,2', '3'], 'price': '10..', 'bad_price': '5..1', 'color': 'BLUE',
+                                        'since': '2020-01-01T08:00:00+08:00', 'page': '2', 'page_size': '500'})
+        getter = param_field_getter(request)
+        ids = ListParam(int)
+        self.assertEqual(getter('ids', required_type=ids), [1, 2, 3])
+        # 同一请求内只解析一次
+        with patch.object(ListParam, 'parse') as parse:
+            self.assertEqual(getter('ids', required_type=ids, allowed_values=[1, 2, 3]), [1, 2, 3])
+            parse.assert_not_called()
+            # 每次新建的同样配置的ParamType也使用缓存
+            self.assertEqual(getter('ids', required_type=ListParam(int)), [1, 2, 3])
+            parse.assert_not_called()
+        self.assertEqual(len(request.__dict__['__project_param_cache__'][1]), 1)
+        self.assertNotEqual(ListParam(int), ListParam(str))
+        self.assertNotEqual(ListParam(int), RangeParam(int))
+        with assert_error(ProjectError.INVALID_FIELD_VALUE, 'but 3 was given'):
+            getter('ids', required_type=ids, allowed_values=[1, 2])
+        self.assertEqual(getter('price', required_type=RangeParam(float)), (10.0, None))
+        with assert_error(ProjectError.WRONG_FIELD_TYPE, 'range of integer'):
+            getter('bad_price', required_type=RangeParam())
+        self.assertEqual(getter('color', required_type=EnumParam(Color)), Color.BLUE)
+        self.assertEqual(getter('since', required_type=DateTimeParam()).year, 2020)
+        with assert_error(ProjectError.WRONG_FIELD_TYPE, 'datetime'):
+            getter('page', required_type=DateTimeParam())
+        with self.assertRaises(TypeError):
+            getter('ids', required_type=list)
+        with assert_error(ProjectError.INVALID_FIELD_VALUE, 'page_size'):
+            get_pagination(request)
+        page = get_pagination(request, Pagination(max_page_size=1000))
+        self.assertEqual((page.page, page.page_size, page.cursor, page.offset), (2, 500, None, 500))
+        schema = Schema({'ids': Field(ids), 'color': Field(EnumParam(Color), allowed_values=[Color.RED])}, 'query')
+        with assert_error(ProjectError.INVALID_FIELD_VALUE, 'color'):
+            schema.validate(request)
+
     def test_multipart_getter(self):
         with open('.gitignore', 'rb') as fp:
             data = {'a': 1, 'b': 'b', 'file': fp, 'c': [1, 2, 3]}
@@ -96,66 +275,569 @@ class HTTPRequestTest(LiveServerTestCase):
             d = fp.read()
             self.assertEqual(d, getter('file', required_type=bytes).read())
 
-    @patch("requests.delete")
-    @patch("requests.patch")
-    @patch("requests.post")
-    @patch("requests.get")
-    def test_json_requester_mocked(self, get: MagicMock, post: MagicMock, patch: MagicMock, delete: MagicMock):
+    def test_schema(self):
+        schema = Schema({
+            'a': Field(int),
+            'b': Field(float, allow_empty=True, default=1.5),
+            'c': Field(str, allowed_values=('x', 'y')),
+            'd': Field(fields={'e': Field(int)}),
+            'f': Field(items=Field(fields={'g': Field(str)})),
+        })
+        body = {'a': 1, 'c': 'x', 'd': {'e': 2}, 'f': [{'g': 'h'}]}
+        request = self.factory.post('', body, content_type='application/json')
+        self.assertEqual(schema.validate(request), {'a': 1, 'b': 1.5, 'c': 'x', 'd': {'e': 2}, 'f': [{'g': 'h'}]})
+        with assert_error(ProjectError.FIELD_MISSING, "a"):
+            schema.validate_data({'c': 'x', 'd': {'e': 2}, 'f': [{'g': 'h'}]})
+        # 所有错误汇总为一个异常
+        try:
+            schema.validate_data({'a': 'a', 'c': 'z', 'd': {'e': 'e'}, 'f': [{'g': 'h'}, {'g': 1}]})
+            self.fail("ProjectException not raised")
+        except Exception as e:
+            self.assertEqual(e.code, ProjectError.WRONG_FIELD_TYPE.code)
+            self.assertEqual([x['field'] for x in e.data['errors']], ['a', 'c', 'd.e', 'f[1].g'])
+            self.assertIn('[x, y]', str(e))
+
+        schema = Schema({'a': Field(int, allow_empty=False), 'b': Field(bool), 'c': Field(default='c')}, 'query')
+        request = self.factory.get('', {'a': 1, 'b': 'true'})
+        self.assertEqual(schema.validate(request), {'a': 1, 'b': True, 'c': 'c'})
+        with assert_error(ProjectError.WRONG_FIELD_TYPE, 'integer'):
+            schema.validate(self.factory.get('', {'a': 'a'}))
+
+        schema = Schema({'a': Field(int), 'c': Field(list), 'file': Field()}, 'multipart')
+        with open('.gitignore', 'rb') as fp:
+            request = self.factory.post('', {'a': 1, 'c': [1, 2], 'file': fp})
+            result = schema.validate(request)
+            self.assertEqual((result['a'], result['c']), (1, ['1', '2']))
+            fp.seek(0)
+            self.assertEqual(result['file'].read(), fp.read())
+        with assert_error(ProjectError.NOT_ACCEPTABLE):
+            schema.validate(self.factory.post('', {}, content_type='application/json'))
+
+    def test_schema_file_sinks(self):
+        with open('.gitignore', 'rb') as fp:
+            content = fp.read()
+        chunks = []
+        schema = Schema({
+            'a': Field(int),
+            'b': Field(str, allowed_values=('x',)),
+            'file': Field(sink=DiskFileSink()),
+            'other': Field(sink=CallbackFileSink(lambda f, chunk: chunks.append(chunk), lambda f: f.size)),
+        }, 'multipart')
+        with open('.gitignore', 'rb') as fp, open('.gitignore', 'rb') as other:
+            request = self.factory.post('', {'a': 1, 'b': 'x', 'file': fp, 'other': other})
+            result = schema.validate(request)
+        self.assertIsInstance(result['file'], StreamedFile)
+        self.assertEqual((result['file'].name, result['file'].size), ('.gitignore', len(content)))
+        with result['file'].open() as f:
+            self.assertEqual(f.read(), content)
+        os.unlink(result['file'].path)
+        self.assertEqual(b''.join(chunks), content)
+        self.assertEqual(result['other'].result, len(content))
+        # 所有字段的错误一起返回
+        try:
+            schema.validate(self.factory.post('', {'a': 'a', 'b': 'y'}))
+            self.fail("ProjectException not raised")
+        except Exception as e:
+            self.assertEqual(e.code, ProjectError.WRONG_FIELD_TYPE.code)
+            self.assertEqual([x['field'] for x in e.data['errors']], ['a', 'b', 'file', 'other'])
+        # 其它字段校验失败时删除已经保存的文件
+        with tempfile.TemporaryDirectory() as directory:
+            schema = Schema({'a': Field(int), 'file': Field(sink=DiskFileSink(directory))}, 'multipart')
+            with open('.gitignore', 'rb') as fp:
+                request = self.factory.post('', {'a': 'a', 'file': fp})
+                with assert_error(ProjectError.WRONG_FIELD_TYPE, 'a'):
+                    schema.validate(request)
+            self.assertIsNone(request.FILES['file'].path)
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_upload_rules(self):
+        class IncompleteSink(FileSink):
+            pass
+
+        with self.assertRaises(TypeError):
+            IncompleteSink()
+        png = b'\x89PNG\r\n\x1a\n' + b'x' * 100
+
+        def post(content=png, content_type='image/png'):
+            return self.factory.post('', {'a': '1', 'file': SimpleUploadedFile('a.png', content, content_type)})
+
+        @stream_uploads({'file': UploadRule(max_size=200, content_types=['image/*'], magic=True,
+                                            sink=HashingFileSink())})
+        def view(request):
+            return request.FILES['file']
+
+        file = view(post())
+        self.assertEqual((file.size, file.digest), (len(png), hashlib.sha256(png).hexdigest()))
+        with assert_error(ProjectError.UNPROCESSABLE, 'larger'):
+            view(post(png * 2))
+        with assert_error(ProjectError.UNPROCESSABLE, 'Content-Type'):
+            view(post(content_type='text/plain'))
+        with assert_error(ProjectError.UNPROCESSABLE, 'match'):
+            view(post(b'text' + png))
+        with assert_error(ProjectError.UNPROCESSABLE, 'match'):
+            view(post(png[:4]))
+        # 没有sink时文件仍由Django保存，Schema中的sink与视图的限制合并
+        rule = UploadRule(max_size=200, magic=[b'\x89PNG'])
+        request = post()
+        stream_uploads({'file': rule})(lambda r: None)(request)
+        self.assertEqual(request.FILES['file'].read(), png)
+        with tempfile.TemporaryDirectory() as directory:
+            schema = Schema({'a': Field(int), 'file': Field(sink=DiskFileSink(directory))}, 'multipart')
+            request = post(png * 2)
+            stream_uploads({'file': rule})(lambda r: None)(request)
+            with assert_error(ProjectError.UNPROCESSABLE):
+                schema.validate(request)
+            self.assertEqual(os.listdir(directory), [])
+            self.assertEqual(len(request.POST), 0)
+        # 请求体解析失败时同样删除已经保存的文件，包括开启统计时提前解析请求体的情况
+        fields = {'file': SimpleUploadedFile('a.png', png, 'image/png'), **{f'f{i}': str(i) for i in range(20)}}
+        self.addCleanup(metrics.disable)
+        with tempfile.TemporaryDirectory() as directory, self.settings(DATA_UPLOAD_MAX_NUMBER_FIELDS=5):
+            schema = Schema({'file': Field(sink=DiskFileSink(directory))}, 'multipart')
+            for enabled in (False, True):
+                metrics.enable() if enabled else metrics.disable()
+                fields['file'].seek(0)
+                with assert_error(ProjectError.UNPROCESSABLE, 'Too many'):
+                    schema.validate(self.factory.post('', fields))
+                self.assertEqual(os.listdir(directory), [])
+                fields['file'].seek(0)
+                request = self.factory.post('', fields)
+                stream_uploads({'file': DiskFileSink(directory)})(lambda r: None)(request)
+                with assert_error(ProjectError.UNPROCESSABLE, 'Too many'):
+                    get_multipart_field(request, 'file')
+                self.assertEqual(os.listdir(directory), [])
+
+    def test_keyset_pagination(self):
+        ModelForTesting.objects.bulk_create([ModelForTesting(a=str(i % 3), b=i) for i in range(7)])
+        queryset = ModelForTesting.objects.values('a', 'b')
+        pages, cursor = [], None
+        while True:
+            request = self.factory.get('', {'page_size': 3, 'cursor': cursor or ''})
+            data = serializer.loads(keyset_response(request, queryset, ('-a', 'b')).content)['data']
+            pages.append([row['b'] for row in data['items']])
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(pages, [[2, 5, 1], [4, 0, 3], [6]])
+        rows, cursor = keyset_paginate(self.factory.get('', {'page_size': 7}), ModelForTesting.objects.all(), 'b')
+        self.assertEqual(([row.b for row in rows], cursor), (list(range(7)), None))
+        for cursor in ('abc', 'W10'):
+            with assert_error(ProjectError.INVALID_FIELD_VALUE, 'cursor'):
+                keyset_paginate(self.factory.get('', {'cursor': cursor}), queryset, ('-a', 'b'))
+        # 游标的值与排序字段的类型不符
+        for values in (['abc'], [{'a': 1}], [[1]], [None]):
+            cursor = base64.urlsafe_b64encode(serializer.dumps(values)).rstrip(b'=').decode()
+            with assert_error(ProjectError.INVALID_FIELD_VALUE, 'cursor'):
+                keyset_paginate(self.factory.get('', {'cursor': cursor}), queryset, 'b')
+
+    def test_cache_response(self):
+        caches['default'].clear()
+        calls = []
+
+        @cache_response({'ids': Field(ListParam(int)), 'page': Field(int, default=1)}, ttl=0.2, stale_ttl=60,
+                        tags=lambda values: [f'page:{values["page"]}'])
+        def view(request):
+            time.sleep(0.1)
+            calls.append(request.GET.urlencode())
+            return json_response({'n': len(calls)})
+
+        def get(query):
+            return serializer.loads(view(self.factory.get('/?' + query)).content)['data']['n']
+
+        # 并发请求只执行一次视图，参数写法不同但值相同的请求共用缓存
+        threads = [threading.Thread(target=get, args=('ids=1,2',)) for _ in range(3)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(get('page=1&ids=1&ids=2'), 1)
+        self.assertEqual(get('ids=2,1'), 2)
+        with assert_error(ProjectError.WRONG_FIELD_TYPE):
+            get('ids=a')
+        invalidate_tags('page:1')
+        self.assertEqual(get('ids=1,2'), 3)
+        # 过期后由一个请求重新执行视图，其它请求返回旧的响应
+        time.sleep(0.25)
+        thread = threading.Thread(target=get, args=('ids=1,2',))
+        thread.start()
+        time.sleep(0.05)
+        self.assertEqual(get('ids=1,2'), 3)
+        thread.join()
+        self.assertEqual(get('ids=1,2'), 4)
+
+        # 命中时返回视图设置的全部响应头，Vary列出的请求头不同时分别缓存，设置了cookie或者Vary为*的响应不缓存
+        @cache_response({'cookie': Field(bool, default=False), 'vary': Field(str, default='Accept-Language')})
+        def header_view(request):
+            calls.append(1)
+            response = json_response({'n': len(calls)})
+            response['X-Custom'] = 'a'
+            response['Vary'] = request.GET.get('vary', 'Accept-Language')
+            if request.GET.get('cookie'):
+                response.set_cookie('session', 'secret')
+            return response
+
+        miss = header_view(self.factory.get('/', HTTP_ACCEPT_LANGUAGE='en'))
+        hit = header_view(self.factory.get('/', HTTP_ACCEPT_LANGUAGE='en'))
+        self.assertEqual((hit.content, dict(hit.items())), (miss.content, dict(miss.items())))
+        self.assertEqual((hit['X-Custom'], hit['Vary']), ('a', 'Accept-Language'))
+        other = header_view(self.factory.get('/', HTTP_ACCEPT_LANGUAGE='fr'))
+        self.assertNotEqual(other.content, miss.content)
+        self.assertEqual(header_view(self.factory.get('/', HTTP_ACCEPT_LANGUAGE='fr')).content, other.content)
+        self.assertEqual(header_view(self.factory.get('/', HTTP_ACCEPT_LANGUAGE='en')).content, miss.content)
+        count = len(calls)
+        for query in ('cookie=true', 'vary=*'):
+            header_view(self.factory.get('/?' + query))
+            header_view(self.factory.get('/?' + query))
+        self.assertEqual(len(calls), count + 4)
+
+        # 读取了session的响应按Cookie分别缓存
+        @cache_response()
+        def user_view(request):
+            return json_response({'user': request.session.get('user')})
+
+        def get_user(user):
+            request = self.factory.get('/', HTTP_COOKIE=f'sessionid={user}')
+            request.session = SessionStore()
+            request.session['user'] = user
+            request.session.accessed = False
+            return serializer.loads(user_view(request).content)['data']['user']
+
+        self.assertEqual([get_user(user) for user in ('a', 'b', 'a', 'b')], ['a', 'b', 'a', 'b'])
+
+    def test_cache_response_leader_error(self):
+        caches['default'].clear()
+        calls = []
+
+        @cache_response(lock_timeout=5)
+        def view(request):
+            calls.append(1)
+            time.sleep(0.2)
+            if len(calls) == 1:
+                raise ProjectError.NOT_FOUND()
+            return json_response({'n': len(calls)})
+
+        errors = []
+
+        def leader():
+            try:
+                view(self.factory.get('/'))
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=leader)
+        thread.start()
+        time.sleep(0.05)
+        # 持锁的请求出错后，等待的请求立即接替执行视图，不等到lock_timeout
+        start = time.monotonic()
+        self.assertEqual(serializer.loads(view(self.factory.get('/')).content)['data'], {'n': 2})
+        self.assertLess(time.monotonic() - start, 2)
+        thread.join()
+        self.assertEqual([e.code for e in errors], [ProjectError.NOT_FOUND.code])
+
+    def test_conditional_json_response(self):
+        res = json_response({'a': 1}, request=self.factory.get(''), etag=True)
+        etag = res['ETag']
+        self.assertEqual(res.status_code, 200)
+        res = json_response({'a': 1}, request=self.factory.get('', HTTP_IF_NONE_MATCH=etag), etag=True)
+        self.assertEqual((res.status_code, res.content, res['ETag']), (304, b'', etag))
+        self.assertEqual(json_response({'a': 2}, request=self.factory.get('', HTTP_IF_NONE_MATCH=etag),
+                                       etag=True).status_code, 200)
+        # 版本号匹配时不生成数据
+        data = MagicMock(return_value={'a': 1})
+        res = json_response(data, request=self.factory.get(''), version=3)
+        self.assertEqual((res.status_code, data.call_count), (200, 1))
+        res = json_response(data, request=self.factory.get('', HTTP_IF_NONE_MATCH=res['ETag']), version=3)
+        self.assertEqual((res.status_code, data.call_count), (304, 1))
+        modified = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        res = json_response({'a': 1}, request=self.factory.get(''), last_modified=modified)
+        self.assertEqual(res['Last-Modified'], 'Wed, 01 Jan 2020 00:00:00 GMT')
+        request = self.factory.get('', HTTP_IF_MODIFIED_SINCE=res['Last-Modified'])
+        self.assertEqual(json_response({'a': 1}, request=request, last_modified=modified).status_code, 304)
+        request = self.factory.get('', HTTP_IF_MODIFIED_SINCE='Tue, 31 Dec 2019 00:00:00 GMT')
+        self.assertEqual(json_response({'a': 1}, request=request, last_modified=modified).status_code, 200)
+
+    def test_compression(self):
+        items = [{'id': i, 'name': f'名称{i}'} for i in range(500)]
+        request = self.factory.get('', HTTP_ACCEPT_ENCODING='gzip;q=0.5, identity, br;q=0')
+        self.assertEqual(negotiate_encoding(request), 'gzip')
+        self.assertIsNone(negotiate_encoding(self.factory.get('', HTTP_ACCEPT_ENCODING='gzip;q=0')))
+        res = json_response(items, request=request, etag=True, compress=True)
+        self.assertEqual((res['Content-Encoding'], res['Vary']), ('gzip', 'Accept-Encoding'))
+        self.assertTrue(res['ETag'].startswith('W/'))
+        self.assertEqual(gzip.decompress(res.content), json_response(items).content)
+        res = json_response(items, request=self.factory.get('', HTTP_IF_NONE_MATCH=res['ETag']), etag=True)
+        self.assertEqual(res.status_code, 304)
+        self.assertFalse(json_response({'a': 1}, request=request, compress=True).has_header('Content-Encoding'))
+        res = stream_json_response(items, chunk_size=100, request=request, compress=True)
+        chunks = list(res.streaming_content)
+        self.assertGreater(len(chunks), 5)
+        self.assertEqual(gzip.decompress(b''.join(chunks)), json_response(items).content)
+
+        caches['default'].clear()
+        calls = []
+
+        @cache_response(compress=True)
+        def view(r):
+            calls.append(r)
+            return json_response(items)
+
+        self.assertEqual(gzip.decompress(view(request).content), json_response(items).content)
+        self.assertEqual(gzip.decompress(view(request).content), json_response(items).content)
+        self.assertEqual(view(self.factory.get('')).content, json_response(items).content)
+        self.assertEqual(len(calls), 2)
+
+    def test_batch_dispatcher(self):
+        requests = [
+            {'method': 'GET', 'path': reverse('param'), 'params': {'a': 1, 'b': 'x'}},
+            {'method': 'POST', 'path': reverse('json'), 'body': {'a': 2}},
+            {'method': 'POST', 'path': reverse('json'), 'body': {'a': 'a', 'b': 1}},
+            {'method': 'GET', 'path': '/not_found/'},
+            {'method': 'GET', 'path': reverse('async'), 'params': {'error': 'project'}},
+        ]
+        for parallel in (False, True):
+            res = self.client.post(reverse('batch'), {'requests': requests, 'parallel': parallel},
+                                   content_type='application/json')
+            items = serializer.loads(res.content)['data']
+            self.assertEqual(items[0], {'msg': 'Success', 'code': 0, 'data': {'a': 1, 'b': 'x'}})
+            self.assertEqual([item['code'] for item in items], [0, ProjectError.FIELD_MISSING.code,
+                                                                ProjectError.WRONG_FIELD_TYPE.code,
+                                                                ProjectError.NOT_FOUND.code,
+                                                                ProjectError.BAD_REQUEST.code])
+        res = self.client.post(reverse('batch'), {'requests': requests * 2}, content_type='application/json')
+        self.assertEqual(serializer.loads(res.content)['code'], ProjectError.INVALID_FIELD_VALUE.code)
+        res = self.client.post(reverse('batch'), {'requests': [{'method': 'POST', 'path': reverse('batch')}]},
+                               content_type='application/json')
+        self.assertEqual(serializer.loads(res.content)['data'][0]['code'], ProjectError.BAD_REQUEST.code)
+
+        # 子请求同样执行中间件的process_view，只能访问allowed_prefixes下的路径
+        requests = [{'method': 'GET', 'path': reverse('param'), 'params': {'a': 1, 'b': 'x'}},
+                    {'method': 'POST', 'path': reverse('json'), 'body': {'a': 2, 'b': 'y'}},
+                    {'method': 'GET', 'path': reverse('other')}]
+        with self.settings(MIDDLEWARE=settings.MIDDLEWARE + ['tests.views.DenyParamViewMiddleware']):
+            batch = batch_dispatcher(allowed_prefixes=['/functional_test_param/', '/functional_test_json/'])
+        request = self.factory.post('', {'requests': requests}, content_type='application/json')
+        items = serializer.loads(batch(request).content)['data']
+        self.assertEqual([item['code'] for item in items], [403, 0, ProjectError.PERMISSION_DENIED.code])
+        self.assertEqual(items[0]['data'], 'denied')
+
+    def test_stream_json_response(self):
+        items = [{'id': i, 'name': f'名称{i}'} for i in range(2500)]
+        self.addCleanup(serializer.set_backend)
+        for backend in ('json', 'orjson', 'ujson'):
+            try:
+                serializer.set_backend(backend)
+            except ValueError:
+                continue
+            res = stream_json_response((x for x in items), chunk_size=1000)
+            self.assertEqual(b''.join(res.streaming_content), json_response(items).content)
+            res = stream_json_response([items[0]], chunk_size=1000)
+            self.assertEqual(b''.join(res.streaming_content), json_response([items[0]]).content)
+        serializer.set_backend()
+        self.assertEqual(b''.join(stream_json_response([]).streaming_content), json_response([]).content)
+        ModelForTesting.objects.bulk_create([ModelForTesting(a=str(i), b=i) for i in range(5)])
+        res = stream_json_response(ModelForTesting.objects.order_by('b').values('a', 'b'), chunk_size=2)
+        self.assertEqual(serializer.loads(b''.join(res.streaming_content))['data'],
+                         [{'a': str(i), 'b': i} for i in range(5)])
+
+    @patch("requests.Session.delete")
+    @patch("requests.Session.patch")
+    @patch("requests.Session.put")
+    @patch("requests.Session.post")
+    @patch("requests.Session.get")
+    def test_json_requester_mocked(self, get: MagicMock, post: MagicMock, put: MagicMock, patch: MagicMock,
+                                   delete: MagicMock):
         self.assertRaises(ValueError, JSONRequester, False, True)
+        mocks = (get, post, put, patch, delete)
         success = {'code': 0, 'msg': 'success', 'data': {'a': 1}}
-        patch_json(get, success)
-        patch_json(post, success)
-        patch_json(delete, success)
-        patch_json(patch, success)
+        for mock in mocks:
+            patch_json(mock, success)
         j = JSONRequester()
-        j.get('')
-        j.post('', json={})
-        j.delete('')
-        j.patch('')
+        results = [j.get(''), j.post('', json={}), j.put('', json={}), j.delete(''), j.patch('')]
+        self.assertEqual([(x.code, x.data) for x in results], [(0, {'a': 1})] * 5)
+        with self.assertRaises(AttributeError):
+            results[0].data = None
         error = ProjectError.PERMISSION_DENIED.to_dict()
-        patch_json(get, error)
-        patch_json(post, error)
-        patch_json(delete, error)
-        patch_json(patch, error)
+        for mock in mocks:
+            patch_json(mock, error)
         with assert_error(ProjectError.PERMISSION_DENIED):
             j.get('')
         with assert_error(ProjectError.PERMISSION_DENIED):
             j.post('')
+        with assert_error(ProjectError.PERMISSION_DENIED):
+            j.put('')
         with assert_error(ProjectError.PERMISSION_DENIED):
             j.delete('')
         with assert_error(ProjectError.PERMISSION_DENIED):
             j.patch('')
-        self.assertEqual(j.msg, error['msg'])
 
         error = ProjectError.WRONG_FIELD_TYPE.to_dict()
         error['code'] = 1312321312321
-        patch_json(get, error)
-        patch_json(post, error)
-        patch_json(delete, error)
-        patch_json(patch, error)
+        for mock in mocks:
+            patch_json(mock, error)
         with assert_error(ProjectError.REMOTE_SERVER_ERROR):
             j.get('')
         with assert_error(ProjectError.REMOTE_SERVER_ERROR):
             j.post('')
+        with assert_error(ProjectError.REMOTE_SERVER_ERROR):
+            j.put('')
         with assert_error(ProjectError.REMOTE_SERVER_ERROR):
             j.delete('')
         with assert_error(ProjectError.REMOTE_SERVER_ERROR):
             j.patch('')
 
-        j = JSONRequester(raise_on_error_code=False)
+        j = JSONRequester(raise_on_error_code=False, timeout=(1, 5))
         j.get('')
         j.post('')
+        j.put('')
         j.patch('')
-        j.delete('')
+        result = j.delete('')
+        self.assertEqual((result.code, result.msg), (error['code'], error['msg']))
+        self.assertEqual(delete.call_args.kwargs['timeout'], (1, 5))
+
+    def test_json_requester_session(self):
+        j = JSONRequester(retries=2, pool_maxsize=4, host_pool_maxsize={'http://special/': 20})
+        retry = j.session.get_adapter('http://a/').max_retries
+        self.assertEqual(retry.total, 2)
+        self.assertNotIn('POST', retry.allowed_methods)
+        self.assertIn('PUT', retry.allowed_methods)
+        self.assertEqual(j.session.get_adapter('http://a/')._pool_maxsize, 4)
+        self.assertEqual(j.session.get_adapter('http://special/x')._pool_maxsize, 20)
+        session = requests.Session()
+        with JSONRequester(session=session) as j:
+            self.assertIs(j.session, session)
 
     def test_json_requester_live(self):
         view = reverse('json_requester')
         j = JSONRequester()
         url = f"{self.live_server_url}{view}"
-        j.post(url, json={'a': 'fnf23oif'})
-        self.assertTrue(j.data, {'a': 'fnf23oif'})
+        result = j.post(url, json={'a': 'fnf23oif'})
+        self.assertEqual(result.data, {'a': 'fnf23oif', 'method': 'POST'})
+        self.assertEqual((result.status, result.headers['content-type']), (200, 'application/json'))
+        self.assertGreater(result.elapsed, 0)
         with assert_error(ProjectError.FIELD_MISSING, "a"):
             j.post(url, json={})
+        result = JSONRequester(raise_on_error_code=False).post(url, json={})
+        self.assertEqual((result.code, result.status), (ProjectError.FIELD_MISSING.code, 422))
+
+        # 同一个requester在多个线程中并发调用，结果互不影响
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda i: j.post(url, json={'a': str(i)}).data['a'], range(8)))
+        self.assertEqual(results, [str(i) for i in range(8)])
 
         with assert_error(ProjectError.REMOTE_SERVER_ERROR):
             j.post('http://fasfdsfasd')
+
+    def test_json_requester_cache(self):
+        url = f"{self.live_server_url}{reverse('cache_control')}"
+        calls = views.cache_control_calls
+        calls.clear()
+        j = JSONRequester(coalesce=True, cache_size=2)
+        results = []
+
+        def get():
+            results.append(j.get(url, params={'delay': 0.2, 'max_age': 60}).data)
+
+        threads = [threading.Thread(target=get) for _ in range(5)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+        self.assertEqual((len(calls), results), (1, [{'calls': 1}] * 5))
+        result = j.get(url, params={'max_age': 60, 'delay': 0.2})
+        self.assertEqual((result.data, result.status), ({'calls': 1}, 200))
+        self.assertEqual(result.headers['Cache-Control'], 'max-age=60')
+        # 没有max-age时每次都通过ETag确认，响应未改变时使用缓存的响应体
+        j.get(url, params={'version': 1})
+        result = j.get(url, params={'version': 1})
+        self.assertEqual((len(calls), result.data), (2, {'calls': 2}))
+        j.get(url, params={'version': 1, 'max_age': 0})
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(j.cache_stats, {'hits': 1, 'misses': 8, 'coalesced': 4, 'size': 2})
+
+    def test_json_requester_coalesced_error(self):
+        j = JSONRequester(coalesce=True)
+        errors = []
+
+        def send(*args, **kwargs):
+            # 等其它线程都加入这次调用之后再失败
+            deadline = time.monotonic() + 5
+            while j.cache_stats['coalesced'] < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            raise requests.ConnectionError('boom')
+
+        def get():
+            try:
+                j.get('http://remote/')
+            except Exception as e:
+                errors.append(e)
+
+        with patch('requests.Session.get', side_effect=send):
+            threads = [threading.Thread(target=get) for _ in range(3)]
+            [t.start() for t in threads]
+            [t.join() for t in threads]
+        # 共用调用的线程得到与发起调用的线程相同的错误，而不是再包装一层
+        self.assertEqual([(e.code, e.error_detail) for e in errors],
+                         [(ProjectError.REMOTE_SERVER_ERROR.code, 'boom')] * 3)
+        self.assertEqual(len({id(e) for e in errors}), 3)
+
+    def test_json_requester_circuit_breaker(self):
+        changes = []
+        breaker = CircuitBreaker(failure_rate=0.5, min_calls=2, open_seconds=0.3,
+                                 on_state_change=lambda host, old, new: changes.append(new))
+        j = JSONRequester(circuit_breaker=breaker)
+        host = self.live_server_url.split('//')[1]
+        ok_url = f"{self.live_server_url}{reverse('slow')}"
+        error_url = f"{self.live_server_url}{reverse('other')}"
+        j.get(ok_url)
+        with assert_error(ProjectError.UNKNOWN_ERROR):
+            j.get(error_url)
+        self.assertEqual(breaker.state(host), 'open')
+        with assert_error(ProjectError.REMOTE_SERVER_ERROR, 'is open'):
+            j.get(ok_url)
+        time.sleep(0.3)
+        # 试探调用失败后再次熔断，成功后恢复
+        with assert_error(ProjectError.UNKNOWN_ERROR):
+            j.get(error_url)
+        time.sleep(0.3)
+        j.get(ok_url)
+        self.assertEqual(changes, ['open', 'half_open', 'open', 'half_open', 'closed'])
+        self.assertEqual(breaker.snapshot()[host]['state'], 'closed')
+
+        j = JSONRequester(bulkhead=Bulkhead(max_concurrent=1))
+        thread = threading.Thread(target=j.get, args=(ok_url, {'seconds': 0.3}))
+        thread.start()
+        time.sleep(0.1)
+        with assert_error(ProjectError.REMOTE_SERVER_ERROR, 'at most 1'):
+            j.get(ok_url)
+        thread.join()
+        j.get(ok_url)
+
+    @skipUnless(httpx, "AsyncJSONRequester requires httpx")
+    def test_async_json_requester_live(self):
+        url = f"{self.live_server_url}{reverse('json_requester')}"
+        slow_url = f"{self.live_server_url}{reverse('slow')}"
+        views.slow_view_barriers['gather'] = threading.Barrier(5)
+        gate = views.slow_view_event(views.slow_view_gates, 'abandoned')
+        finished = views.slow_view_event(views.slow_view_finished, 'abandoned')
+
+        async def run():
+            async with AsyncJSONRequester() as requester:
+                res = await requester.post(url, json={'a': 'fnf23oif'})
+                self.assertEqual(res.data, {'a': 'fnf23oif', 'method': 'POST'})
+                with assert_error(ProjectError.FIELD_MISSING, "a"):
+                    await requester.put(url, json={})
+                with assert_error(ProjectError.REMOTE_SERVER_ERROR):
+                    await requester.get('http://fasfdsfasd')
+                # 并发调用，5个请求同时到达服务端后才能返回
+                params = {'seconds': 0.1, 'barrier': 'gather'}
+                results = await requester.gather(*[requester.get(slow_url, params) for _ in range(5)])
+                self.assertEqual([x.data['seconds'] for x in results], [0.1] * 5)
+                # 第一个请求在超时之前不会返回
+                abandoned = {'gate': 'abandoned', 'finished': 'abandoned'}
+                results = await requester.gather(requester.get(slow_url, abandoned),
+                                                 requester.post(url, json={'a': 'b'}),
+                                                 deadline=0.3, return_exceptions=True)
+                self.assertEqual(results[0].code, ProjectError.REMOTE_SERVER_ERROR.code)
+                self.assertEqual(results[1].data['a'], 'b')
+                # 等待被放弃的请求在服务端结束，避免它在测试结束后才访问数据库连接
+                gate.set()
+                self.assertTrue(await asyncio.get_running_loop().run_in_executor(None, finished.wait, 5))
+
+        asyncio.run(run())
@@ -0,0 +1,51 @@
+import datetime
+import json
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.test import TestCase
+from djapi import serializer
+
+
+class TestSerializer(TestCase):
+    data = {'a': '中文', 'b': [1, 2.5, None, True], 'c': {'d': 'e/f'}, 1: 'int key',
+            'time': datetime.datetime(2020, 1, 2, 3, 4, 5, 678901), 'decimal': Decimal('1.10')}
+
+    def tearDown(self) -> None:
+        serializer.set_backend()
+
+    def test_json_backend(self):
+        serializer.set_backend('json')
+        expected = json.dumps(self.data, cls=DjangoJSONEncoder, ensure_ascii=False).encode()
+        self.assertEqual(serializer.dumps(self.data), expected)
+        self.assertEqual(serializer.loads(expected)['a'], '中文')
+        self.assertRaises(ValueError, serializer.loads, b'{"a": ')
+
+    def test_fast_backends(self):
+        expected = json.loads(json.dumps(self.data, cls=DjangoJSONEncoder))
+        for name in ('orjson', 'ujson'):
+            try:
+                backend = serializer.set_backend(name)
+            except ValueError:
+                continue
+            body = serializer.dumps(self.data)
+            self.assertIsInstance(body, bytes)
+            self.assertIn('中文'.encode(), body)
+            self.assertEqual(backend.loads(body), expected)
+            self.assertRaises(ValueError, serializer.loads, b'{"a": ')
+
+    def test_fallback_to_json(self):
+        # 超过64位的整数、NaN和Infinity在所有后端的输出都与json后端一致
+        data = {'big': 2 ** 70, 'small': -2 ** 70, 'nan': float('nan'), 'inf': [float('inf')], 'none': None}
+        expected = json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False).encode()
+        for name in ('orjson', 'ujson', 'json'):
+            try:
+                serializer.set_backend(name)
+            except ValueError:
+                continue
+            self.assertEqual(serializer.dumps({'big': 2 ** 70}), b'{"big": 1180591620717411303424}')
+            self.assertEqual(serializer.dumps([float('nan')]), b'[NaN]')
+            self.assertEqual(serializer.dumps(data), expected)
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, serializer.set_backend, 'simplejson')
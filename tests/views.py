@@ -1,5 +1,9 @@
+import threading
+import time
+
+from django.http import HttpResponseForbidden
 from djapi.error import ProjectError
-from djapi.req import json_field_getter, json_response, param_field_getter, multipart_getter
+from djapi.req import json_field_getter, json_response, param_field_getter, multipart_getter, require_GET_api
 
 
 def functional_test_json_view(request):
@@ -51,3 +55,75 @@ def test_json_requester(request):
     getter = json_field_getter(request)
     a = getter('a', str)
     return json_response({'a': a, 'method': request.method})
+
+
+# test_slow_view的同步信号，测试通过参数指定名字，避免依赖耗时判断
+slow_view_barriers = {}
+slow_view_gates = {}
+slow_view_finished = {}
+
+
+def slow_view_event(events: dict, name: str) -> threading.Event:
+    return events.setdefault(name, threading.Event())
+
+
+def test_slow_view(request):
+    getter = param_field_getter(request)
+    seconds = getter('seconds', required_type=float, default=0.0)
+    try:
+        barrier = getter('barrier')
+        if barrier is not None:
+            # 所有请求都到达后才继续，请求不是并发执行时等待超时报错
+            slow_view_barriers[barrier].wait(timeout=5)
+        gate = getter('gate')
+        if gate is not None:
+            slow_view_event(slow_view_gates, gate).wait(timeout=5)
+        time.sleep(seconds)
+        return json_response({'seconds': seconds})
+    finally:
+        finished = getter('finished')
+        if finished is not None:
+            slow_view_event(slow_view_finished, finished).set()
+
+
+@require_GET_api
+async def test_async_view(request):
+    getter = param_field_getter(request)
+    error = getter('error')
+    if error == 'project':
+        raise ProjectError.BAD_REQUEST("async")
+    if error == 'unknown':
+        raise FileExistsError("Unknown Exception")
+    return json_response({'thread': threading.get_ident()})
+
+
+# test_cache_control_view生成响应体的次数
+cache_control_calls = []
+
+
+def test_cache_control_view(request):
+    getter = param_field_getter(request)
+    time.sleep(getter('delay', required_type=float, default=0.0))
+    response = json_response(lambda: {'calls': cache_control_calls.append(1) or len(cache_control_calls)},
+                             request=request, version=getter('version'))
+    max_age = getter('max_age')
+    if max_age is not None:
+        response['Cache-Control'] = f'max-age={max_age}'
+    return response
+
+
+class DenyParamViewMiddleware:
+    """
+    在process_view中拒绝访问functional_test_param_view
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if view_func is functional_test_param_view:
+            return HttpResponseForbidden('denied')
+        return None